@@ -5,75 +5,94 @@
 The app will interact with Database through SQLAlchemy. And with oauth
 providers through project defined functions in oauth_providers module.
 
-The routes' protection are performed using JWT.
+The app is built by create_app, which registers the views declared in
+this module. The routes' protection are performed using JWT.
 Revoked JWT tokens are blacklisted and controlled through Redis.
-Redis will also be used to control the throughput of user requests to the site.
+Redis is also used to control the throughput of user requests to the site.
 """
 
 from flask import (
-    Flask, render_template, jsonify, request, g, flash, redirect, url_for
+    Flask, render_template, jsonify, request, g, flash, redirect, url_for,
+    Response, stream_with_context, abort, current_app
 )
 from flask_jwt_extended import (
     JWTManager, jwt_required, jwt_optional, create_access_token,
     jwt_refresh_token_required, create_refresh_token, get_jwt_identity,
-    set_access_cookies, set_refresh_cookies, unset_jwt_cookies, get_csrf_token
+    set_access_cookies, set_refresh_cookies, unset_jwt_cookies, get_csrf_token,
+    get_raw_jwt, decode_token
 )
+from sqlalchemy.exc import IntegrityError
+import os
 import random
 import string
-import json
 
 from database import db_session, User, Category, Item
+from passwords import PasswordHashingBusy
+from query_loading import (
+    route_query, find_item, keyset_page, replica_reads, mark_primary_reads
+)
+from catalog_export import iter_catalog_json
+from json_encoding import (
+    json_response, parse_fields, item_columns, row_dicts, InvalidFields
+)
+from page_cache import (
+    page_cache, cached_page, invalidate_item_pages, notify_item_writes
+)
+from category_registry import category_registry
+from search import search_items
+from item_batch import apply_batch, MAX_BATCH_OPERATIONS
+from change_feed import get_changes
+from identity_cache import identity_cache, snapshot
+from token_blocklist import token_blocklist
+from rate_limit import rate_limited
+from metrics import init_metrics
+from query_report import init_query_report
+from readiness import init_readiness
+from compression import CompressionMiddleware
+from assets import init_assets
+from fork_safety import check_fork
+from revisions import (
+    bump_revisions, catalog_revision, category_revision, conditional
+)
 from oauth_providers import (
-    oauth_google, oauth_facebook, register_oauth_user, oauth_disconnect
+    oauth_google, oauth_facebook, register_oauth_user, oauth_disconnect,
+    provider_config
 )
 
 
-# Create app
-app = Flask(__name__)
-app.config['DEBUG'] = False
-
-# Configure application to store JWTs in cookies
-app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+# The JWTManager is linked to the app by create_app
+jwt = JWTManager()
 
-# Only allow JWT cookies to be sent over https. In production, change this
-# to True
-app.config['JWT_COOKIE_SECURE'] = False
+# Cached pages list the categories in the navbar
+category_registry.on_change.append(page_cache.clear)
 
-# Set the cookie paths, so that you are only sending your access token
-# cookie to the access endpoints, and only sending your refresh token
-# to the refresh endpoint. Technically this is optional, but it is in
-# your best interest to not send additional cookies in the request if
-# they aren't needed.
-app.config['JWT_ACCESS_COOKIE_PATH'] = '/'
-app.config['JWT_REFRESH_COOKIE_PATH'] = '/'
+# Views and error handlers declared below, registered in the app by
+# create_app
+_routes = []
+_error_handlers = []
 
-# Enable csrf double submit protection. See this for a thorough
-# explanation: http://www.redotheweb.com/2015/11/09/api-security.html
-app.config['JWT_COOKIE_CSRF_PROTECT'] = True
 
-# Using secrets module only available on Python 3.6 or above
-# state = ''.join(secrets.choice(string.ascii_uppercase + string.digits)
-#                for _ in range(32))
-app.config['SECRET_KEY'] = ''.join(random.SystemRandom().choice(
-    string.ascii_uppercase + string.digits) for _ in range(32))
-app.config['JWT_SECRET_KEY'] = ''.join(random.SystemRandom().choice(
-    string.ascii_uppercase + string.digits) for _ in range(32))
+def route(rule, **options):
+    """Decorator to declare a view of a URL rule, like Flask app.route."""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
 
-# Create the JWTManager linked to Flask app
-jwt = JWTManager(app)
 
-# Load the pre-defined DB categories.
-categories = db_session.query(Category).all()
+def error_handler(exception):
+    """Decorator to declare an error handler, like Flask app.errorhandler."""
+    def decorator(handler):
+        _error_handlers.append((exception, handler))
+        return handler
+    return decorator
 
-# Load the Oauth client IDs from JSON file
-with app.open_resource('./static/json/google_client_secrets.json') as f:
-    g_client_id = json.load(f)['web']['client_id']
 
-with app.open_resource('./static/json/facebook_client_secrets.json') as f:
-    f_client_id = json.load(f)['web']['app_id']
+def inject_categories():
+    """Make the registry categories available to every template."""
+    return {'categories': category_registry.all()}
 
 
-@app.teardown_appcontext
 def shutdown_session(exception=None):
     """Automatically remove database sessions.
 
@@ -82,37 +101,78 @@ def shutdown_session(exception=None):
     db_session.remove()
 
 
+class DuplicatedItem(Exception):
+    """Raised when an item write violates the unique item name index."""
+
+
+def commit_items():
+    """Commit the item writes of the session.
+
+    Raises:
+        DuplicatedItem: if an item was added or renamed with the name of
+        another item of the same category.
+    """
+    try:
+        db_session.commit()
+    except IntegrityError as e:
+        db_session.rollback()
+        raise DuplicatedItem() from e
+
+
 # Views
 
-@app.route('/')
-@app.route('/catalog')
+@route('/')
+@route('/catalog')
 @jwt_optional
+@replica_reads
+@cached_page(lambda: ['catalog'])
 def catalog():
     """Index page that shows the latest added items in the catalog."""
-    items = db_session.query(Item).order_by(Item.id.desc()).limit(9)
-    return render_template('catalog.html', categories=categories, items=items)
+    items = route_query('catalog').order_by(Item.id.desc()).limit(9)
+    return render_template('catalog.html', items=items)
 
 
-@app.route('/catalog/<string:category>')
+@route('/catalog/<string:category>')
 @jwt_optional
+@replica_reads
+@cached_page(lambda category: ['category:' + category])
 def category(category):
-    """Show all items added to a specific category."""
-    items = db_session.query(Item).join(Category).filter(
-        Category.name == category).all()
-    return render_template('category.html', categories=categories,
-                           category=category, items=items)
+    """Show the items added to a specific category, a page at a time."""
+    query = route_query('category').join(Category).filter(
+        Category.name == category)
+    limit = request.args.get('limit', type=int)
+    items, next_after = keyset_page(
+        query, after=request.args.get('after', type=int), limit=limit)
+    return render_template('category.html', category=category, items=items,
+                           next_after=next_after, limit=limit)
 
 
-@app.route('/catalog/<string:category>/<string:item>')
+@route('/catalog/<string:category>/<string:item>')
 @jwt_optional
+@replica_reads
+@cached_page(lambda category, item: ['item:' + item])
 def item(category, item):
     """Page for showing an item information."""
-    item = db_session.query(Item).filter_by(name=item).first()
-    return render_template('item.html', categories=categories,
-                           category=category, item=item)
+    item = find_item(category, item, 'item')
+    if item is None:
+        abort(404)
+    return render_template('item.html', category=category, item=item)
 
 
-@app.route('/catalog/<string:category>/add', methods=['GET', 'POST'])
+@route('/catalog/search')
+@jwt_optional
+@replica_reads
+def search():
+    """Show the items matching the search terms, ranked by relevance."""
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', type=int)
+    items, next_page = search_items(
+        q, page=request.args.get('page', type=int), limit=limit)
+    return render_template('search.html', q=q, items=items,
+                           next_page=next_page, limit=limit)
+
+
+@route('/catalog/<string:category>/add', methods=['GET', 'POST'])
 @jwt_required
 def add_item(category):
     """Route for item adding page or to process form submission.
@@ -120,11 +180,11 @@ def add_item(category):
     The item data from form will be added in the database.
     """
     if request.method == 'GET':
-        return render_template('add_item.html', categories=categories,
-                               category=category)
+        return render_template('add_item.html', category=category)
     elif request.method == 'POST':
-        cat = db_session.query(Category).filter_by(
-            name=request.form['category']).one()
+        cat = category_registry.get(request.form['category'])
+        if cat is None:
+            return jsonify(error='Unknown category.'), 400
         item = Item(
             name=request.form['name'],
             description=request.form['description'],
@@ -132,20 +192,25 @@ def add_item(category):
             user_id=g.user.id
         )
         db_session.add(item)
-        db_session.commit()
+        bump_revisions(cat.id)
+        commit_items()
+        invalidate_item_pages(cat.name, item.name)
+        notify_item_writes()
+        mark_primary_reads()
         return redirect(url_for('catalog'), code=303)
 
 
-@app.route('/catalog/<string:category>/<string:item>/edit',
-           methods=['GET', 'PUT'])
+@route('/catalog/<string:category>/<string:item>/edit',
+       methods=['GET', 'PUT'])
 @jwt_required
 def edit_item(category, item):
     """Route for item editing page or to process form submission.
 
     The item data from form will be updated in the database.
     """
-    i = db_session.query(Item).join(Category).filter(
-        Item.name == item, Category.name == category).first()
+    i = find_item(category, item, 'edit_item')
+    if i is None:
+        abort(404)
 
     # Unauthorized users can't edit items from other users.
     # The HTML pages are protected but this is implemented to avoid manually
@@ -155,31 +220,38 @@ def edit_item(category, item):
             error="Unauthorized. You can't edit others user's item."), 401
 
     if request.method == 'GET':
-        return render_template('edit_item.html', categories=categories,
-                               category=category, item=i)
+        return render_template('edit_item.html', category=category, item=i)
     elif request.method == 'PUT':
         i.name = request.form['name']
         i.description = request.form['description']
 
         # In case of category change, we need the new ID
-        cat = db_session.query(Category).filter_by(
-            name=request.form['category']).one()
+        cat = category_registry.get(request.form['category'])
+        if cat is None:
+            return jsonify(error='Unknown category.'), 400
+        bump_revisions(i.category_id, cat.id)
         i.category_id = cat.id
         db_session.add(i)
-        db_session.commit()
+        commit_items()
+        # Pages showing the item before and after the edition
+        invalidate_item_pages(category, item)
+        invalidate_item_pages(cat.name, i.name)
+        notify_item_writes()
+        mark_primary_reads()
         return redirect(url_for('catalog'), code=303)
 
 
-@app.route('/catalog/<string:category>/<string:item>/delete',
-           methods=['GET', 'DELETE'])
+@route('/catalog/<string:category>/<string:item>/delete',
+       methods=['GET', 'DELETE'])
 @jwt_required
 def delete_item(category, item):
     """Route for item deleting page or to process form submission.
 
     After confirmation, the item from form will be deleted from database.
     """
-    i = db_session.query(Item).join(Category).filter(
-        Item.name == item, Category.name == category).first()
+    i = find_item(category, item, 'delete_item')
+    if i is None:
+        abort(404)
 
     # Unauthorized users can't delete items from other users.
     # The HTML pages are protected but this is implemented to avoid manually
@@ -189,62 +261,183 @@ def delete_item(category, item):
             error="Unauthorized. You can't delete others user's item."), 401
 
     if request.method == 'GET':
-        return render_template('delete_item.html', categories=categories,
-                               category=category, item=i)
+        return render_template('delete_item.html', category=category, item=i)
     elif request.method == 'DELETE':
         db_session.delete(i)
+        bump_revisions(i.category_id)
         db_session.commit()
+        invalidate_item_pages(category, item)
+        notify_item_writes()
+        mark_primary_reads()
         return redirect(url_for('catalog'), code=303)
 
 
-@app.route('/catalog/api/v1/catalog.json')
+@route('/catalog/api/v1/items:batch', methods=['POST'])
+@jwt_required
+@rate_limited
+def batch_items():
+    """API end point for creating, updating and deleting many items at once.
+
+    The request JSON has the operations list in the operations key. They're
+    applied in a single transaction, only if all of them are valid. See the
+    item_batch module for the operations format.
+
+    Returns:
+        A response in JSON format with the result of each operation.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list):
+        return jsonify(error='Missing operations list.'), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify(error='At most {} operations per batch.'.format(
+            MAX_BATCH_OPERATIONS)), 413
+
+    results, valid, changes = apply_batch(operations, g.user.id)
+    if not valid:
+        db_session.rollback()
+        return jsonify(Results=results), 422
+
+    if changes.category_ids:
+        bump_revisions(*changes.category_ids)
+    commit_items()
+    for category_name, item_name in changes.pages:
+        invalidate_item_pages(category_name, item_name)
+    notify_item_writes()
+    mark_primary_reads()
+    return jsonify(Results=results)
+
+
+@route('/catalog/api/v1/catalog.json')
 @jwt_required
+@rate_limited
+@replica_reads
+@conditional(catalog_revision)
 def catalog_json():
     """API end point for sending all catalog in JSON format.
 
+    The catalog is streamed in chunks read through a server-side cursor, so
+    the memory used doesn't grow with the catalog size. The optional query
+    argument fields is the comma separated list of item fields to be sent.
+
+    Returns:
+        A streamed response in JSON format.
+    """
+    fields = parse_fields(request.args.get('fields'))
+    return Response(stream_with_context(iter_catalog_json(fields=fields)),
+                    mimetype='application/json')
+
+
+@route('/catalog/api/v1/search.json')
+@jwt_required
+@rate_limited
+@replica_reads
+def search_json():
+    """API end point for searching items by name and description.
+
+    The query arguments are q, the search terms, and the optional page and
+    limit, the page size. When there are more items, the URL of the next page
+    is sent in the next field.
+
     Returns:
         A response in JSON format.
     """
-    categories = db_session.query(Category).all()
-    items = db_session.query(Item).all()
-    catalog = []
-    for c in categories:
-        cat = c.serialize
-        cat['Item'] = [i.serialize for i in items if i.category_id == c.id]
-        catalog.append(cat)
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', type=int)
+    items, next_page = search_items(
+        q, route='search_json', page=request.args.get('page', type=int),
+        limit=limit)
+    next_url = None
+    if next_page is not None:
+        next_url = url_for('search_json', q=q, page=next_page, limit=limit)
+    return jsonify(Item=[i.serialize for i in items], next=next_url)
+
+
+@route('/catalog/api/v1/changes.json')
+@jwt_required
+@rate_limited
+@replica_reads
+def changes_json():
+    """API end point for the item changes since a catalog revision.
 
-    return jsonify(Catalog=catalog)
+    The query arguments are since, the last revision already synced by the
+    client, and limit, the page size. The changes are in revision order and
+    the client must request again with since set to the revision field until
+    the next field is null.
+
+    Returns:
+        A response in JSON format.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    changes, next_since = get_changes(since, limit)
+    next_url = None
+    if next_since is not None:
+        next_url = url_for('changes_json', since=next_since, limit=limit)
+    revision = changes[-1]['revision'] if changes else since
+    return jsonify(Changes=changes, revision=revision, next=next_url)
 
 
-@app.route('/catalog/api/v1/<string:category>.json')
+@route('/catalog/api/v1/<string:category>.json')
 @jwt_required
+@rate_limited
+@replica_reads
+@conditional(category_revision)
 def category_json(category):
     """API end point for getting the category and items inside of it.
 
+    The items are paginated. The optional query arguments are limit, the page
+    size, and after, the last item id of the previous page. When there are
+    more items, the URL of the next page is sent in the next field. The
+    optional query argument fields is the comma separated list of item
+    fields to be sent.
+
     Returns:
         A response in JSON format.
     """
-    c = db_session.query(Category).filter_by(name=category).first()
-    items = db_session.query(Item).filter_by(category_id=c.id)
-    cat = c.serialize
-    cat['Item'] = [item.serialize for item in items]
-    return jsonify(Category=cat)
-
-
-@app.route('/catalog/api/v1/<string:category>/<string:item>.json')
+    c = category_registry.get(category)
+    if c is None:
+        return jsonify(error='Category not found.'), 404
+    fields = parse_fields(request.args.get('fields'))
+    limit = request.args.get('limit', type=int)
+    items, next_after = keyset_page(
+        db_session.query(*item_columns(fields)).filter(
+            Item.category_id == c.id),
+        after=request.args.get('after', type=int), limit=limit)
+    next_url = None
+    if next_after is not None:
+        next_url = url_for('category_json', category=category,
+                           after=next_after, limit=limit,
+                           fields=request.args.get('fields'))
+    return json_response({
+        'Category': {'id': c.id, 'name': c.name,
+                     'Item': row_dicts(items, fields)},
+        'next': next_url})
+
+
+@route('/catalog/api/v1/<string:category>/<string:item>.json')
 @jwt_required
+@rate_limited
+@replica_reads
+@conditional(lambda category, item: category_revision(category))
 def item_json(category, item):
     """API end point for getting an item information in JSON format.
 
+    The optional query argument fields is the comma separated list of item
+    fields to be sent.
+
     Returns:
         A response in JSON format.
     """
-    i = db_session.query(Item).join(Category).filter(
-        Item.name == item, Category.name == category).first()
-    return jsonify(Item=i.serialize)
+    fields = parse_fields(request.args.get('fields'))
+    row = find_item(category, item, 'item_json', *item_columns(fields))
+    if row is None:
+        return jsonify(error='Item not found.'), 404
+    return json_response({'Item': dict(zip(fields, row))})
 
 
-@app.route('/catalog/site_login', methods=['GET', 'POST'])
+@route('/catalog/site_login', methods=['GET', 'POST'])
+@rate_limited
 def site_login():
     """Route for login page or to process site login form submission.
 
@@ -252,10 +445,10 @@ def site_login():
     the jwt access and refresh tokens are sent back trough cookies.
     """
     if request.method == 'GET':
-        return render_template('login.html',
-                               categories=categories,
-                               g_client_id=g_client_id,
-                               f_client_id=f_client_id)
+        return render_template(
+            'login.html',
+            g_client_id=provider_config.get('google')['client_id'],
+            f_client_id=provider_config.get('facebook')['app_id'])
     elif request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
@@ -264,13 +457,17 @@ def site_login():
             flash('Invalid username and/or password.')
             return redirect(url_for('site_login'), code=303)
         else:
+            # Save the password hash if it was upgraded during verification
+            if user in db_session.dirty:
+                db_session.commit()
             g.user = user
             response = redirect(url_for('catalog'), code=303)
             response = set_jwt_token(response)
             return response
 
 
-@app.route('/catalog/oauth_login/<string:provider>', methods=['POST'])
+@route('/catalog/oauth_login/<string:provider>', methods=['POST'])
+@rate_limited
 def oauth_login(provider):
     """Route for oauth providers login."""
     if provider == 'google':
@@ -309,7 +506,7 @@ def oauth_login(provider):
     return response
 
 
-@app.route('/catalog/login/disconnect')
+@route('/catalog/login/disconnect')
 @jwt_required
 def disconnect():
     """Logout and revoke a current user's tokens.
@@ -318,20 +515,37 @@ def disconnect():
      """
     if g.get('user'):
         if g.user.provider:
+            # The site logout goes on even if the provider is unavailable
             response = oauth_disconnect()
             if response.get('error'):
-                return jsonify(
-                    error=response.get('error')
-                ), response.get('status')
+                flash('Logged out, but the {} access could not be revoked: '
+                      '{}'.format(g.user.provider.capitalize(),
+                                  response.get('error')))
 
+        identity_cache.invalidate(g.user.id)
         g.user = None
 
+    # Revoke the access token and the refresh token sent along, if valid.
+    # If the blocklist is unavailable, the revocations are kept pending by
+    # token_blocklist and the cookies are unset anyway.
+    raw_jwt = get_raw_jwt()
+    token_blocklist.revoke(raw_jwt['jti'], raw_jwt['exp'])
+    refresh_token = request.cookies.get(
+        current_app.config['JWT_REFRESH_COOKIE_NAME'])
+    if refresh_token:
+        try:
+            raw_jwt = decode_token(refresh_token)
+            token_blocklist.revoke(raw_jwt['jti'], raw_jwt['exp'])
+        except Exception:
+            pass
+
     response = redirect(url_for('catalog'), code=303)
     unset_jwt_cookies(response)
     return response
 
 
-@app.route('/catalog/new_user', methods=['GET', 'POST'])
+@route('/catalog/new_user', methods=['GET', 'POST'])
+@rate_limited
 def new_user():
     """Route for new user login page or to process form submission.
 
@@ -339,7 +553,7 @@ def new_user():
     the jwt access and refresh tokens are sent back trough cookies.
     """
     if request.method == 'GET':
-        return render_template('new_user.html', categories=categories)
+        return render_template('new_user.html')
     elif request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
@@ -361,6 +575,7 @@ def new_user():
         user.hash_password(password)
         db_session.add(user)
         db_session.commit()
+        identity_cache.invalidate(user.id)
         g.user = user
         response = redirect(url_for('catalog'), code=303)
         response = set_jwt_token(response)
@@ -369,7 +584,7 @@ def new_user():
 
 # Same thing as login here, except we are only setting a new cookie
 # for the access token.
-@app.route('/catalog/api/v1/token/refresh', methods=['POST'])
+@route('/catalog/api/v1/token/refresh', methods=['POST'])
 @jwt_refresh_token_required
 def refresh_app_token():
     """API end point for refreshing an user access token.
@@ -421,22 +636,69 @@ def set_jwt_token(response):
 def get_db_user(identity):
     """This function receives the user identity and load it from DB.
 
-    The user is set in the global flask variable g.
+    The user snapshot is cached, so the DB is only hit when the user is not
+    in the identity cache. The user is set in the global flask variable g.
 
     Args:
         identity (int): the user id.
 
     Returns:
-        The user obj loaded from DB or None if it's not found.
+        The user snapshot or None if it's not found.
     """
-    user = db_session.query(User).filter_by(id=identity).first()
+    user = identity_cache.get(identity)
     if user is None:
-        return None
+        db_user = db_session.query(User).filter_by(id=identity).first()
+        if db_user is None:
+            return None
+        user = snapshot(db_user)
+        identity_cache.set(user)
 
     g.user = user
     return user
 
 
+@error_handler(DuplicatedItem)
+def duplicated_item(error):
+    """This function will be run when an item write violates the unique
+    index.
+
+    It happens when an item is added or renamed with the name of another
+    item of the same category.
+    """
+    return jsonify(
+        error='An item with this name already exists in the category.'), 409
+
+
+@error_handler(InvalidFields)
+def invalid_fields(error):
+    """This function will be run when an API request asks unknown fields."""
+    return jsonify(error=str(error)), 400
+
+
+@error_handler(PasswordHashingBusy)
+def password_hashing_busy(error):
+    """This function will be run when the password hashing pool is saturated.
+
+    The client is asked to retry the login or registration later.
+    """
+    response = jsonify(error='Too many logins in progress. Try again later.')
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+@jwt.token_in_blacklist_loader
+def is_token_revoked(decrypted_token):
+    """This function checks if a token was revoked by the user logout.
+
+    Args:
+        decrypted_token (dict): the decoded token claims.
+
+    Returns:
+        bool: True if the token is revoked, False otherwise.
+    """
+    return token_blocklist.is_revoked(decrypted_token['jti'])
+
+
 @jwt.expired_token_loader
 @jwt.invalid_token_loader
 @jwt.revoked_token_loader
@@ -456,6 +718,101 @@ def invalid_token(*args, **kwargs):
     return response
 
 
+def random_key():
+    """Generate a random secret key.
+
+    Returns:
+        str: 32 random uppercase letters and digits.
+    """
+    # Using secrets module only available on Python 3.6 or above
+    # state = ''.join(secrets.choice(string.ascii_uppercase + string.digits)
+    #                for _ in range(32))
+    return ''.join(random.SystemRandom().choice(
+        string.ascii_uppercase + string.digits) for _ in range(32))
+
+
+def create_app(config=None):
+    """Create the Flask application.
+
+    No DB connection is opened and no file is read here: every resource is
+    initialized when first needed, so the app is created even while the DB
+    is unavailable. Processes forked after creating the app, like preloaded
+    WSGI workers, discard the inherited DB connections and thread pools.
+    The /ready route tells when a process can serve requests.
+
+    Args:
+        config (dict): settings overriding the default app config.
+
+    Returns:
+        The Flask application.
+    """
+    app = Flask(__name__)
+    app.config['DEBUG'] = False
+
+    # Configure application to store JWTs in cookies
+    app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+
+    # Only allow JWT cookies to be sent over https. In production, change this
+    # to True
+    app.config['JWT_COOKIE_SECURE'] = False
+
+    # Set the cookie paths, so that you are only sending your access token
+    # cookie to the access endpoints, and only sending your refresh token
+    # to the refresh endpoint. Technically this is optional, but it is in
+    # your best interest to not send additional cookies in the request if
+    # they aren't needed.
+    app.config['JWT_ACCESS_COOKIE_PATH'] = '/'
+    app.config['JWT_REFRESH_COOKIE_PATH'] = '/'
+
+    # Enable csrf double submit protection. See this for a thorough
+    # explanation: http://www.redotheweb.com/2015/11/09/api-security.html
+    app.config['JWT_COOKIE_CSRF_PROTECT'] = True
+
+    # Check access and refresh tokens against the revoked tokens blocklist
+    app.config['JWT_BLACKLIST_ENABLED'] = True
+    app.config['JWT_BLACKLIST_TOKEN_CHECKS'] = ['access', 'refresh']
+
+    # The keys must be shared by all the worker processes, so set them in the
+    # environment. Otherwise each process signs with its own random key.
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or random_key()
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY') or \
+        random_key()
+    app.config.update(config or {})
+
+    # Without os.register_at_fork, forked processes replace the inherited
+    # thread pools and connections on their first request
+    app.before_request(check_fork)
+
+    jwt.init_app(app)
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for exception, handler in _error_handlers:
+        app.register_error_handler(exception, handler)
+    app.context_processor(inject_categories)
+    app.teardown_appcontext(shutdown_session)
+
+    # Collect the routes latency and SQL queries metrics, exposed in /metrics
+    init_metrics(app)
+
+    # Per request SQL statements report. Enable it only for diagnostics,
+    # setting QUERY_REPORT=1 in the environment.
+    init_query_report(app)
+
+    # Warm up the process on its first readiness probe in /ready
+    init_readiness(app)
+
+    # Link the fingerprinted static files built by running assets.py
+    init_assets(app)
+
+    # Compress the responses and serve the precompressed static files,
+    # created by running compression.py
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app, static_folder=app.static_folder,
+        static_url_path=app.static_url_path)
+
+    return app
+
+
 if __name__ == '__main__':
     """Running from command line starts the Flask application."""
-    app.run(host='0.0.0.0', port=5000)
+    create_app().run(host='0.0.0.0', port=5000)
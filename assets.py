@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+"""Utility module to serve the static files with fingerprinted names.
+
+A build step copies every static file to the build folder with the hash of
+its content in the name, like build/css/styles.0a1b2c3d4e.css, and records
+the names in the asset manifest. The app url_for then links the static
+files by their fingerprinted names, which are sent with far-future immutable
+cache headers: a changed file gets a new name, so browsers never need to
+revalidate the one they cached.
+
+The build step also creates resized JPEG and WebP variants of the images,
+used by the templates through image_src and image_srcset, so browsers
+download the smallest image good enough for the screen. The variants need
+the Pillow package, without it the images are only fingerprinted.
+
+When running this module from command line it will build the fingerprinted
+files and the manifest. Run it before compression.py, so the built files
+are precompressed too:
+
+    python3 assets.py [static folder]
+"""
+
+from hashlib import sha1
+import io
+import json
+import os
+import sys
+
+from flask import request, url_for
+
+# Optional dependency. Image variants are not created without it.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Folder of the built files and name of the manifest, inside static folder
+BUILD_FOLDER = 'build'
+MANIFEST = 'manifest.json'
+# Static subfolders not served as assets, like the client secrets
+SKIP_FOLDERS = ('json',)
+# Widths of the image variants, in pixels
+IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Cache header of the fingerprinted files, they never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(filename, data):
+    """Insert the content hash in a file name.
+
+    Args:
+        filename (str): the file name relative to the static folder.
+        data (bytes): the file content.
+
+    Returns:
+        str: the fingerprinted name, inside the build folder.
+    """
+    base, ext = os.path.splitext(filename)
+    return '{}/{}.{}{}'.format(BUILD_FOLDER, base,
+                               sha1(data).hexdigest()[:10], ext)
+
+
+def write_file(static_folder, filename, data):
+    """Write a built file, unless it already exists."""
+    path = os.path.join(static_folder, *filename.split('/'))
+    if not os.path.isfile(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def image_variants(static_folder, filename):
+    """Create the resized JPEG and WebP variants of an image.
+
+    Variants are never wider than the original image.
+
+    Args:
+        static_folder (str): the static files folder.
+        filename (str): the image name relative to the static folder.
+
+    Returns:
+        list: the variants, dicts with their name, width and content type.
+    """
+    variants = []
+    with Image.open(os.path.join(static_folder, filename)) as image:
+        image = image.convert('RGB')
+        base = os.path.splitext(filename)[0]
+        widths = [w for w in IMAGE_WIDTHS if w < image.width]
+        for width in widths or [image.width]:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for ext, content_type, options in (
+                    ('.jpg', 'image/jpeg', {'format': 'JPEG', 'quality': 80,
+                                            'optimize': True,
+                                            'progressive': True}),
+                    ('.webp', 'image/webp', {'format': 'WEBP',
+                                             'quality': 75, 'method': 6})):
+                buffer = io.BytesIO()
+                resized.save(buffer, **options)
+                data = buffer.getvalue()
+                variant = fingerprint(
+                    '{}-{}w{}'.format(base, width, ext), data)
+                write_file(static_folder, variant, data)
+                variants.append({'file': variant, 'width': width,
+                                 'type': content_type})
+    return variants
+
+
+def build_assets(static_folder):
+    """Build the fingerprinted files and the asset manifest.
+
+    Args:
+        static_folder (str): the static files folder.
+
+    Returns:
+        dict: the manifest, with the fingerprinted name of every file and
+        the variants of every image.
+    """
+    manifest = {'files': {}, 'variants': {}}
+    for folder, dirs, files in os.walk(static_folder):
+        rel = os.path.relpath(folder, static_folder).replace(os.sep, '/')
+        if rel == '.':
+            rel = ''
+            dirs[:] = [d for d in dirs
+                       if d not in SKIP_FOLDERS + (BUILD_FOLDER,)]
+        for name in sorted(files):
+            filename = rel + '/' + name if rel else name
+            # Skip the manifest and the precompressed siblings
+            if filename == MANIFEST or name.endswith(('.gz', '.br')):
+                continue
+            with open(os.path.join(folder, name), 'rb') as f:
+                data = f.read()
+            manifest['files'][filename] = fingerprint(filename, data)
+            write_file(static_folder, manifest['files'][filename], data)
+            ext = os.path.splitext(name)[1].lower()
+            if Image is not None and ext in IMAGE_EXTENSIONS:
+                manifest['variants'][filename] = image_variants(
+                    static_folder, filename)
+
+    with open(os.path.join(static_folder, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest(object):
+    """The fingerprinted names and image variants of the static files."""
+
+    def __init__(self, static_folder):
+        """Load the manifest of a static folder.
+
+        Without a manifest, the files are linked by their original names.
+
+        Args:
+            static_folder (str): the static files folder.
+        """
+        try:
+            with open(os.path.join(static_folder, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        self.files = manifest.get('files', {})
+        self.variants = manifest.get('variants', {})
+        self.built = set(self.files.values()).union(
+            v['file'] for variants in self.variants.values()
+            for v in variants)
+
+    def url_defaults(self, endpoint, values):
+        """Replace the static file names by the fingerprinted ones in URLs.
+
+        Registered as the app url defaults function, so url_for('static',
+        filename=...) links the fingerprinted file.
+        """
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.files.get(values['filename'],
+                                                values['filename'])
+
+    def cache_headers(self, response):
+        """Send the fingerprinted files with immutable cache headers."""
+        if (request.endpoint != 'static' or
+                response.status_code not in (200, 304)):
+            return response
+        filename = request.view_args.get('filename', '')
+        # The precompressed siblings have the same fingerprinted name
+        for ext in ('.gz', '.br'):
+            if filename.endswith(ext):
+                filename = filename[:-len(ext)]
+        if filename in self.built:
+            response.headers['Cache-Control'] = IMMUTABLE
+            response.expires = None
+        return response
+
+    def image_src(self, filename):
+        """Get the URL of the largest JPEG variant of an image.
+
+        It's the image src fallback for browsers not supporting srcset.
+
+        Args:
+            filename (str): the image name relative to the static folder.
+
+        Returns:
+            str: the variant URL, or the image URL if it has no variants.
+        """
+        variants = [v for v in self.variants.get(filename, ())
+                    if v['type'] == 'image/jpeg']
+        if variants:
+            filename = max(variants, key=lambda v: v['width'])['file']
+        return url_for('static', filename=filename)
+
+    def image_srcset(self, filename, content_type='image/jpeg'):
+        """Build the srcset attribute value of an image.
+
+        Args:
+            filename (str): the image name relative to the static folder.
+            content_type (str): the type of the variants listed.
+            Default value is image/jpeg.
+
+        Returns:
+            str: the variants URLs with their widths, or an empty string if
+            the image has no variants.
+        """
+        return ', '.join(
+            '{} {}w'.format(url_for('static', filename=v['file']), v['width'])
+            for v in self.variants.get(filename, ())
+            if v['type'] == content_type)
+
+
+def init_assets(app):
+    """Link the fingerprinted static files in the app.
+
+    Args:
+        app: the Flask application.
+
+    Returns:
+        AssetManifest: the manifest loaded from the app static folder.
+    """
+    manifest = AssetManifest(app.static_folder)
+    app.url_defaults(manifest.url_defaults)
+    app.after_request(manifest.cache_headers)
+    app.add_template_global(manifest.image_src, 'image_src')
+    app.add_template_global(manifest.image_srcset, 'image_srcset')
+    return manifest
+
+
+# When running this module from command line it will build the fingerprinted
+# static files and the asset manifest.
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'static')
+    if Image is None:
+        print('Pillow is not installed, image variants are not created.')
+    built = build_assets(folder)
+    print('{} files fingerprinted, {} image variants created.'.format(
+        len(built['files']),
+        sum(len(v) for v in built['variants'].values())))
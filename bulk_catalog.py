@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+"""Module to bulk import and export the catalog from command line.
+
+The import reads a catalog file in the same format of the catalog API end
+point, or NDJSON with one item or category per line, and inserts the items in
+batches inside a single transaction: COPY on PostgreSQL and executemany on
+other databases. The export streams the catalog to a file in any of these
+formats.
+
+Usage:
+    python3 bulk_catalog.py import catalog.json --user-id 1
+    python3 bulk_catalog.py export catalog.ndjson
+"""
+
+from sqlalchemy import func, select
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from database import engine, Category, Item
+from catalog_export import iter_catalog_json, YIELD_PER
+from json_encoding import dumps
+from category_registry import category_registry
+from page_cache import notify_item_writes
+from search import index_items
+from change_feed import stamp_new_items
+
+# Optional dependency to parse big JSON files without loading them in memory
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Number of items inserted per round trip
+BATCH_SIZE = 5000
+
+
+def expand_category(category):
+    """Turn a category object of the catalog format into records.
+
+    Args:
+        category (dict): a category with its name and Item list. The name
+        may also be in the category key, as in populate_db.
+
+    Yields:
+        dict: a category record and one record per item.
+    """
+    name = category.get('name', category.get('category'))
+    yield {'category': name}
+    for i in category.get('Item', ()):
+        yield {'category': name,
+               'name': i['name'],
+               'description': i.get('description')}
+
+
+def read_records(f, ndjson=False):
+    """Read the catalog records from a file.
+
+    Args:
+        f: the catalog file object.
+        ndjson (bool): True if the file has one JSON object per line, either
+        an item with its category name in the category key or a category in
+        the catalog format. False if it's in the catalog format.
+
+    Yields:
+        dict: the records with the category name and, for items, the item
+        name and description.
+    """
+    if ndjson:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'Item' in record:
+                for r in expand_category(record):
+                    yield r
+            else:
+                yield record
+        return
+
+    categories = (ijson.items(f, 'Catalog.item') if ijson
+                  else json.load(f)['Catalog'])
+    for c in categories:
+        for r in expand_category(c):
+            yield r
+
+
+def copy_items(conn, batch):
+    """Insert a batch of items with the PostgreSQL COPY command."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for i in batch:
+        writer.writerow((i['name'], i['description'], i['category_id'],
+                         i['user_id']))
+    buf.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        'COPY item (name, description, category_id, user_id) '
+        'FROM STDIN WITH (FORMAT csv)', buf)
+    cursor.close()
+
+
+def insert_items(conn, batch):
+    """Insert a batch of items in a single executemany call."""
+    conn.execute(Item.__table__.insert(), batch)
+
+
+def import_catalog(records, user_id, bind=engine, batch_size=BATCH_SIZE):
+    """Insert catalog records in batches inside a single transaction.
+
+    Missing categories are created. The search index of the new items and
+    the revisions of the changed categories and items are updated in the
+    same transaction, and the category registry afterwards, since batch
+    inserts bypass the ORM.
+
+    Args:
+        records: iterable of records, as generated by read_records.
+        user_id (int): the id of the user owning the imported items.
+        bind: the SQLAlchemy engine. Default is the application engine.
+        batch_size (int): number of items per insert. Default is BATCH_SIZE.
+
+    Returns:
+        int: the number of imported items.
+    """
+    insert = copy_items if bind.dialect.name == 'postgresql' else insert_items
+    count = 0
+    new_categories = False
+    with bind.begin() as conn:
+        # Resolve all existing categories at once
+        categories = dict(conn.execute(
+            select([Category.name, Category.id])).fetchall())
+        # Items inserted from now on have greater ids
+        last_id = conn.execute(select([func.max(Item.id)])).scalar() or 0
+        changed = set()
+        batch = []
+        for r in records:
+            category_id = categories.get(r['category'])
+            if category_id is None:
+                category_id = conn.execute(Category.__table__.insert().values(
+                    name=r['category'])).inserted_primary_key[0]
+                categories[r['category']] = category_id
+                new_categories = True
+            if r.get('name') is None:
+                continue
+
+            changed.add(category_id)
+            batch.append({'name': r['name'],
+                          'description': r.get('description'),
+                          'category_id': category_id,
+                          'user_id': user_id})
+            if len(batch) >= batch_size:
+                insert(conn, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            insert(conn, batch)
+            count += len(batch)
+
+        if changed:
+            conn.execute(Category.__table__.update().where(
+                Category.id.in_(changed)).values(
+                revision=Category.revision + 1))
+            # The imported items enter the change feed, one revision each
+            stamp_new_items(conn)
+            index_items(conn, last_id)
+
+    if changed:
+        notify_item_writes()
+    if new_categories:
+        category_registry.changed()
+    return count
+
+
+def iter_catalog_ndjson(bind=engine, yield_per=YIELD_PER):
+    """Generate the catalog in NDJSON format, one item per line.
+
+    Args:
+        bind: the SQLAlchemy engine. Default is the application engine.
+        yield_per (int): number of rows fetched from the cursor at a time.
+        Default value is YIELD_PER.
+
+    Yields:
+        bytes: the catalog lines. Categories without items are sent as
+        category records.
+    """
+    with bind.connect() as conn:
+        used = set()
+        rows = conn.execution_options(stream_results=True).execute(
+            select([Category.name, Item.name, Item.description]).select_from(
+                Item.__table__.join(Category.__table__)).order_by(
+                Item.category_id, Item.id))
+        while True:
+            chunk = rows.fetchmany(yield_per)
+            if not chunk:
+                break
+            for category, name, description in chunk:
+                used.add(category)
+                yield dumps({'category': category, 'name': name,
+                             'description': description}) + b'\n'
+        for (category,) in conn.execute(select([Category.name])):
+            if category not in used:
+                yield dumps({'category': category}) + b'\n'
+
+
+def main(argv=None):
+    """Parse the command line arguments and run the import or export."""
+    parser = argparse.ArgumentParser(
+        description='Bulk import and export of the item catalog.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('file', help='the catalog file, - for stdin/stdout')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='one JSON object per line. Default if the file '
+                             'name ends with .ndjson')
+    parser.add_argument('--user-id', type=int,
+                        help='owner of the imported items')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    ndjson = args.ndjson or args.file.endswith('.ndjson')
+
+    start = time.monotonic()
+    if args.command == 'import':
+        if args.user_id is None:
+            parser.error('--user-id is required to import')
+        f = sys.stdin if args.file == '-' else open(args.file, 'rb')
+        with f:
+            count = import_catalog(read_records(f, ndjson), args.user_id,
+                                   batch_size=args.batch_size)
+    else:
+        f = sys.stdout.buffer if args.file == '-' else open(args.file, 'wb')
+        count = 0
+        with f:
+            if ndjson:
+                for line in iter_catalog_ndjson():
+                    f.write(line)
+                    count += 1
+            else:
+                # The JSON chunks hold many rows, count the items instead
+                count = engine.execute(
+                    select([func.count(Item.id)])).scalar()
+                for chunk in iter_catalog_json():
+                    f.write(chunk)
+
+    elapsed = time.monotonic() - start
+    print('{} rows in {:.1f}s ({:.0f}/s).'.format(
+        count, elapsed, count / elapsed if elapsed else count),
+        file=sys.stderr)
+
+
+# When running this module from command line it will import or export the
+# catalog.
+if __name__ == '__main__':
+    main()
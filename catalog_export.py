@@ -0,0 +1,62 @@
+"""Utility module to stream the whole catalog in JSON format.
+
+The catalog is read with a server-side cursor, items ordered by category, and
+emitted as JSON text chunks. This way the memory used to export the catalog is
+constant and the cost is linear in the catalog size, no matter how many items
+are stored in the database. Rows are read as plain tuples with only the
+requested item columns, without building ORM objects.
+"""
+
+from database import db_session, Category, Item
+from json_encoding import dumps, item_columns, ITEM_FIELDS
+
+
+# Number of rows fetched per round trip and of items buffered per text chunk
+YIELD_PER = 1000
+
+
+def iter_catalog_json(session=db_session, yield_per=YIELD_PER,
+                      fields=ITEM_FIELDS):
+    """Generate the catalog JSON document in text chunks.
+
+    The document has the same format of the catalog API end point:
+        {"Catalog": [{"id": ..., "name": ..., "Item": [...]}, ...]}
+
+    Args:
+        session: the SQLAlchemy session used to query the DB.
+        Default is the application scoped session.
+        yield_per (int): number of rows fetched from the cursor at a time.
+        Default value is YIELD_PER.
+        fields (tuple): the item fields sent. Default value is ITEM_FIELDS.
+
+    Yields:
+        bytes: the next piece of the JSON document.
+    """
+    categories = session.query(Category.id, Category.name).order_by(
+        Category.id).all()
+    # Plain row tuples, the category id last to merge them with categories
+    items = session.query(*item_columns(fields) + [Item.category_id]).order_by(
+        Item.category_id, Item.id).yield_per(yield_per)
+
+    yield b'{"Catalog":['
+    buffer = []
+    iter_items = iter(items)
+    item = next(iter_items, None)
+    for n, (category_id, name) in enumerate(categories):
+        cat = dumps({'id': category_id, 'name': name})
+        # Open the category object and its item list
+        buffer.append(b''.join([b',' if n else b'', cat[:-1], b',"Item":[']))
+        first = True
+        # Items are ordered by category, so consume the ones from this
+        # category and stop at the first item of the next one
+        while item is not None and item[-1] == category_id:
+            data = dumps(dict(zip(fields, item)))
+            buffer.append(data if first else b',' + data)
+            first = False
+            if len(buffer) >= yield_per:
+                yield b''.join(buffer)
+                buffer = []
+            item = next(iter_items, None)
+        buffer.append(b']}')
+    buffer.append(b']}')
+    yield b''.join(buffer)
@@ -0,0 +1,245 @@
+"""Utility module to keep an in-memory registry of the catalog categories.
+
+The categories are read on almost every request, to build the site navbar and
+to resolve the category of added or edited items, but they rarely change. So
+they're kept in memory as lightweight snapshots indexed by name.
+
+The registry reloads itself when its TTL expires or when another process
+notifies a change. The notification is pluggable:
+    PostgreSQL LISTEN/NOTIFY when the database is PostgreSQL;
+    a file modification time otherwise (SQLite databases and tests).
+"""
+
+from collections import namedtuple, OrderedDict
+from threading import Lock
+import os
+import tempfile
+import time
+
+from database import db_session, engine, Category
+from fork_safety import after_fork
+
+
+# Immutable category data shared by all threads
+CategorySnapshot = namedtuple('CategorySnapshot', ['id', 'name'])
+
+# Maximum time in seconds that the registry is kept without reloading
+TTL = 300
+
+# PostgreSQL notification channel of category changes
+CHANNEL = 'category_changed'
+# Seconds to wait before listening again after the connection failed
+RECONNECT_INTERVAL = 5
+
+
+class PostgresNotifier(object):
+    """Notify category changes through PostgreSQL LISTEN/NOTIFY."""
+
+    def __init__(self, bind, channel=CHANNEL):
+        """Create the notifier. The listening connection is opened lazily.
+
+        Args:
+            bind: the SQLAlchemy engine of a PostgreSQL database.
+            channel (str): the notification channel. Default is CHANNEL.
+        """
+        self.bind = bind
+        self.channel = channel
+        self._conn = None
+        self._version = 0
+        self._retry_at = 0
+        self._lock = Lock()
+
+    def version(self):
+        """Get the number of change notifications received so far.
+
+        While the listening connection is down, notifications may be lost,
+        so every failure also counts as a change. The connection is opened
+        again after RECONNECT_INTERVAL seconds.
+
+        Returns:
+            int: the current version.
+        """
+        dbapi = self.bind.dialect.dbapi
+        with self._lock:
+            try:
+                if self._conn is None:
+                    if time.monotonic() < self._retry_at:
+                        return self._version
+                    self._listen()
+                    # Changes may have happened while not listening
+                    self._version += 1
+                self._conn.poll()
+            except dbapi.Error:
+                self._disconnect()
+                self._retry_at = time.monotonic() + RECONNECT_INTERVAL
+                self._version += 1
+                return self._version
+            while self._conn.notifies:
+                self._conn.notifies.pop()
+                self._version += 1
+            return self._version
+
+    def notify(self):
+        """Notify every listening process that the categories changed."""
+        # The notification is only sent when the transaction commits
+        with self.bind.begin() as conn:
+            conn.execute('NOTIFY {}'.format(self.channel))
+
+    def after_fork(self):
+        """Forget the listening connection inherited by a forked process."""
+        self._conn = None
+        self._lock = Lock()
+
+    def _listen(self):
+        """Open a dedicated autocommit connection listening to the channel.
+
+        The connection is opened outside of the engine pool, so it's never
+        handed to the requests.
+        """
+        cargs, cparams = self.bind.dialect.create_connect_args(self.bind.url)
+        self._conn = self.bind.dialect.dbapi.connect(*cargs, **cparams)
+        self._conn.autocommit = True
+        cursor = self._conn.cursor()
+        cursor.execute('LISTEN {}'.format(self.channel))
+        cursor.close()
+
+    def _disconnect(self):
+        """Close the listening connection, ignoring errors."""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except self.bind.dialect.dbapi.Error:
+                pass
+            self._conn = None
+
+
+class FileNotifier(object):
+    """Notify category changes by touching a file shared by the processes."""
+
+    def __init__(self, path):
+        """Create the notifier.
+
+        Args:
+            path (str): the path of the file used for notification.
+        """
+        self.path = path
+
+    def version(self):
+        """Get the file modification time.
+
+        Returns:
+            int: the current version or 0 if no change was notified yet.
+        """
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def notify(self):
+        """Notify every process that the categories changed."""
+        with open(self.path, 'a'):
+            os.utime(self.path)
+
+
+def create_notifier(bind=engine, channel=CHANNEL):
+    """Create the change notifier suitable for the database.
+
+    Args:
+        bind: the SQLAlchemy engine. Default is the application engine.
+        channel (str): the notification channel. Default is CHANNEL.
+
+    Returns:
+        A PostgresNotifier for PostgreSQL databases, a FileNotifier
+        otherwise. The file path can be set in CATEGORY_NOTIFY_FILE
+        environment variable. Other channels use that path followed by
+        the channel name.
+    """
+    if bind.dialect.name == 'postgresql':
+        return PostgresNotifier(bind, channel)
+    path = os.environ.get('CATEGORY_NOTIFY_FILE', os.path.join(
+        tempfile.gettempdir(), 'item_catalog_categories'))
+    if channel != CHANNEL:
+        path = '{}.{}'.format(path, channel)
+    return FileNotifier(path)
+
+
+class CategoryRegistry(object):
+    """Thread safe in-memory registry of the categories indexed by name."""
+
+    def __init__(self, notifier, ttl=TTL, session=db_session):
+        """Create the registry. The categories are loaded lazily.
+
+        Args:
+            notifier: the change notifier, PostgresNotifier or FileNotifier.
+            ttl (int): maximum time in seconds without reloading.
+            Default value is TTL.
+            session: the SQLAlchemy session used to load the categories.
+            Default is the application scoped session.
+        """
+        self.notifier = notifier
+        self.ttl = ttl
+        self.session = session
+        self.on_change = []
+        self._by_name = OrderedDict()
+        self._version = None
+        self._expires = 0
+        self._lock = Lock()
+
+    def all(self):
+        """Get all categories.
+
+        Returns:
+            list: the CategorySnapshot of every category, ordered by id.
+        """
+        return list(self._current().values())
+
+    def get(self, name):
+        """Get a category by its name.
+
+        Args:
+            name (str): the category name.
+
+        Returns:
+            CategorySnapshot: the category or None if it doesn't exist.
+        """
+        return self._current().get(name)
+
+    def changed(self):
+        """Notify every process, this included, that categories changed.
+
+        To be called after committing category writes.
+        """
+        self.notifier.notify()
+        self._expires = 0
+
+    def _current(self):
+        """Get the category map, reloading it if it's stale."""
+        version = self.notifier.version()
+        if version != self._version or time.monotonic() > self._expires:
+            with self._lock:
+                if (version != self._version or
+                        time.monotonic() > self._expires):
+                    self._reload(version)
+        return self._by_name
+
+    def _reload(self, version):
+        """Load the categories from DB. The lock must be held."""
+        rows = self.session.query(Category.id, Category.name).order_by(
+            Category.id).all()
+        by_name = OrderedDict(
+            (name, CategorySnapshot(id, name)) for id, name in rows)
+        changed = self._version is not None and by_name != self._by_name
+        # Replace the whole map so readers never see it half built
+        self._by_name = by_name
+        self._version = version
+        self._expires = time.monotonic() + self.ttl
+        if changed:
+            for callback in self.on_change:
+                callback()
+
+
+category_registry = CategoryRegistry(create_notifier())
+
+# Each forked process listens to the notifications on its own connection
+if hasattr(category_registry.notifier, 'after_fork'):
+    after_fork(category_registry.notifier.after_fork)
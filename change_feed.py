@@ -0,0 +1,103 @@
+"""Utility module to provide the incremental change feed of the catalog items.
+
+Every item insert, update and delete takes the next catalog revision from the
+single row revision counter, in the same transaction, by SQLAlchemy mapper
+events. Changed items keep their last revision and deleted items leave a
+tombstone with the revision of the deletion.
+
+Since incrementing the counter locks its row until the transaction ends,
+item writes commit in revision order. So a client that read all changes up
+to a revision never misses a change committed later with a lower one.
+"""
+
+from sqlalchemy import event, func, select
+
+from database import db_session, Item, ItemTombstone, CatalogRevision
+from query_loading import PAGE_SIZE, MAX_PAGE_SIZE
+
+
+def next_revision(connection):
+    """Increment the catalog revision counter.
+
+    Args:
+        connection: the SQLAlchemy connection of the write transaction.
+
+    Returns:
+        int: the new catalog revision.
+    """
+    table = CatalogRevision.__table__
+    connection.execute(table.update().where(table.c.id == 1).values(
+        value=table.c.value + 1))
+    return connection.execute(
+        select([table.c.value]).where(table.c.id == 1)).scalar()
+
+
+def stamp_new_items(connection):
+    """Give a revision to each item inserted bypassing the ORM events.
+
+    The items not stamped yet, with revision 0, get consecutive revisions in
+    their id order, so every change in the feed has its own revision and
+    pages can't split changes of the same revision.
+
+    Args:
+        connection: the SQLAlchemy connection of the write transaction.
+    """
+    table = Item.__table__
+    first_id = connection.execute(select([func.min(table.c.id)]).where(
+        table.c.revision == 0)).scalar()
+    if first_id is None:
+        return
+    # Taking the first revision locks the counter until the transaction ends
+    first = next_revision(connection)
+    connection.execute(table.update().where(table.c.revision == 0).values(
+        revision=table.c.id - first_id + first))
+    counter = CatalogRevision.__table__
+    connection.execute(counter.update().where(counter.c.id == 1).values(
+        value=select([func.max(table.c.revision)]).as_scalar()))
+
+
+@event.listens_for(Item, 'before_insert')
+@event.listens_for(Item, 'before_update')
+def set_item_revision(mapper, connection, target):
+    """Stamp an inserted or updated item with the next revision."""
+    target.revision = next_revision(connection)
+
+
+@event.listens_for(Item, 'after_delete')
+def add_tombstone(mapper, connection, target):
+    """Leave a tombstone of a deleted item with the next revision."""
+    connection.execute(ItemTombstone.__table__.insert().values(
+        item_id=target.id, category_id=target.category_id,
+        name=target.name, revision=next_revision(connection)))
+
+
+def get_changes(since=0, limit=PAGE_SIZE):
+    """Get the item changes after a revision, in revision order.
+
+    Args:
+        since (int): the last revision already known by the client.
+        Default value is 0, all changes.
+        limit (int): the page size. It's bounded between 1 and MAX_PAGE_SIZE.
+        Default value is PAGE_SIZE.
+
+    Returns:
+        A tuple with the list of changes and the revision to request the next
+        page with, or None if this is the last page. Each change has the
+        revision, the op, upsert or delete, and the item data.
+    """
+    since = since or 0
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    items = db_session.query(Item).filter(Item.revision > since).order_by(
+        Item.revision).limit(limit + 1).all()
+    tombstones = db_session.query(ItemTombstone).filter(
+        ItemTombstone.revision > since).order_by(
+        ItemTombstone.revision).limit(limit + 1).all()
+
+    changes = sorted(
+        [(i.revision, 'upsert', i.serialize) for i in items] +
+        [(t.revision, 'delete', t.serialize) for t in tombstones],
+        key=lambda change: change[0])
+    page = [{'revision': rev, 'op': op, 'Item': data}
+            for rev, op, data in changes[:limit]]
+    next_since = page[-1]['revision'] if len(changes) > limit else None
+    return page, next_since
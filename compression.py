@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+#
+"""Utility module to compress the application responses.
+
+A WSGI middleware negotiates the response encoding with the client, by the
+Accept-Encoding header, preferring brotli when the brotli package is
+installed and gzip otherwise. Only textual content types above MIN_SIZE are
+compressed, since images like the JPEG photos are already compressed.
+Streamed responses, like the catalog JSON export, are compressed chunk by
+chunk and every chunk is flushed, so the client gets it right away.
+
+Static files may have precompressed .br and .gz siblings, compressed once at
+the highest level. They're served instead of the original files, without
+compressing them on every request.
+
+When running this module from command line it will create the precompressed
+siblings of the static files:
+
+    python3 compression.py [static folder]
+"""
+
+from werkzeug.http import parse_accept_header
+import gzip
+import mimetypes
+import os
+import sys
+import zlib
+
+# Optional dependency. Only gzip is used without it.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses smaller than this are not worth compressing
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+# Compression levels of the responses compressed on the fly
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript',
+    'application/xml', 'image/svg+xml',
+)
+
+# Precompressed static files extensions by encoding, in preference order
+STATIC_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def is_compressible(content_type):
+    """Check if a content type is worth compressing.
+
+    Args:
+        content_type (str): the Content-Type header value.
+
+    Returns:
+        bool: True if the type is textual, False otherwise.
+    """
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def accepted_encodings(environ):
+    """Get the response encodings supported by the client and the server.
+
+    Args:
+        environ (dict): the WSGI environment.
+
+    Returns:
+        list: the encodings in preference order.
+    """
+    accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+    encodings = ['br'] if brotli is not None else []
+    return [e for e in encodings + ['gzip'] if accept.quality(e) > 0]
+
+
+class Compressor(object):
+    """Incremental compressor of a response body."""
+
+    def __init__(self, encoding):
+        """Create the compressor.
+
+        Args:
+            encoding (str): br or gzip.
+        """
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def compress(self, data, flush=False):
+        """Compress a piece of the body.
+
+        Args:
+            data (bytes): the piece of the body.
+            flush (bool): True to send out all data compressed so far.
+            Default value is False.
+
+        Returns:
+            bytes: the compressed data available.
+        """
+        out = self._compress(data)
+        return out + self._flush() if flush else out
+
+    def finish(self):
+        """End the compressed stream.
+
+        Returns:
+            bytes: the remaining compressed data.
+        """
+        return self._finish()
+
+
+class CompressedBody(object):
+    """WSGI response iterable compressing the application one."""
+
+    def __init__(self, app_iter, compressor):
+        """Wrap the application response iterable.
+
+        Args:
+            app_iter: the application response iterable.
+            compressor (Compressor): the body compressor.
+        """
+        self.app_iter = app_iter
+        self.compressor = compressor
+
+    def __iter__(self):
+        """Generate the compressed chunks, one per application chunk."""
+        for chunk in self.app_iter:
+            if chunk:
+                yield self.compressor.compress(chunk, flush=True)
+        yield self.compressor.finish()
+
+    def close(self):
+        """Close the application iterable, as the WSGI server would do."""
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware compressing the responses and serving the
+    precompressed static files."""
+
+    def __init__(self, app, static_folder=None, static_url_path='/static',
+                 min_size=MIN_SIZE):
+        """Wrap a WSGI application.
+
+        Args:
+            app: the WSGI application.
+            static_folder (str): the static files folder. None to not serve
+            precompressed files.
+            static_url_path (str): the URL prefix of the static files.
+            Default value is /static.
+            min_size (int): the smallest response compressed, in bytes.
+            Default value is MIN_SIZE.
+        """
+        self.app = app
+        self.static_folder = static_folder
+        self.static_prefix = static_url_path.rstrip('/') + '/'
+        self.min_size = min_size
+
+    def find_precompressed(self, environ, encodings):
+        """Find the precompressed sibling of a requested static file.
+
+        Returns:
+            A tuple with the sibling encoding and extension or None if there
+            is no up to date sibling in an accepted encoding.
+        """
+        path = environ.get('PATH_INFO', '')
+        if not self.static_folder or not path.startswith(self.static_prefix):
+            return None
+        parts = path[len(self.static_prefix):].split('/')
+        if '..' in parts or '' in parts:
+            return None
+        filename = os.path.join(self.static_folder, *parts)
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return None
+        for encoding, ext in STATIC_ENCODINGS:
+            sibling = filename + ext
+            if (encoding in encodings and os.path.isfile(sibling) and
+                    os.path.getmtime(sibling) >= mtime):
+                return encoding, ext
+        return None
+
+    def __call__(self, environ, start_response):
+        """Run the application and compress its response if possible."""
+        encodings = accepted_encodings(environ)
+        precompressed = self.find_precompressed(environ, encodings)
+        if precompressed is not None:
+            return self.serve_precompressed(environ, start_response,
+                                            *precompressed)
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response.update(status=status, headers=headers,
+                            exc_info=exc_info)
+            return response.setdefault('written', []).append
+
+        app_iter = self.app(environ, capture)
+        status, headers = response['status'], response['headers']
+        if response.get('written'):
+            # Body sent through the legacy write callable
+            app_iter = response['written'] + list(app_iter)
+        header = dict((k.lower(), v) for k, v in headers)
+
+        if not is_compressible(header.get('content-type')):
+            start_response(status, headers, response['exc_info'])
+            return app_iter
+        headers = vary_accept_encoding(headers)
+        length = header.get('content-length')
+        if (not encodings or environ['REQUEST_METHOD'] == 'HEAD' or
+                status[:3] in ('204', '206', '304') or
+                'content-encoding' in header or
+                'no-transform' in header.get('cache-control', '') or
+                (length is not None and int(length) < self.min_size)):
+            start_response(status, headers, response['exc_info'])
+            return app_iter
+
+        # The compressed body isn't byte to byte the same of the resource
+        headers = [(k, weak_etag(v) if k.lower() == 'etag' else v)
+                   for k, v in headers if k.lower() != 'content-length']
+        headers.append(('Content-Encoding', encodings[0]))
+        body = CompressedBody(app_iter, Compressor(encodings[0]))
+        if length is None:
+            # Streamed response, compress it as it's generated
+            start_response(status, headers, response['exc_info'])
+            return body
+
+        try:
+            data = b''.join(body)
+        finally:
+            body.close()
+        headers.append(('Content-Length', str(len(data))))
+        start_response(status, headers, response['exc_info'])
+        return [data]
+
+    def serve_precompressed(self, environ, start_response, encoding, ext):
+        """Serve the precompressed sibling of a static file.
+
+        The request is passed to the application with the sibling path, so
+        it's sent with the same caching and conditional request handling of
+        the original file.
+        """
+        path = environ['PATH_INFO']
+        content_type = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+        if content_type.startswith('text/') or content_type in (
+                'application/javascript', 'application/xml'):
+            content_type += '; charset=utf-8'
+
+        def add_encoding(status, headers, exc_info=None):
+            headers = [(k, v) for k, v in headers
+                       if k.lower() != 'content-type']
+            headers.append(('Content-Type', content_type))
+            if status[:3] in ('200', '206', '304'):
+                headers.append(('Content-Encoding', encoding))
+            return start_response(status, vary_accept_encoding(headers),
+                                  exc_info)
+
+        environ = dict(environ, PATH_INFO=path + ext)
+        return self.app(environ, add_encoding)
+
+
+def vary_accept_encoding(headers):
+    """Add Accept-Encoding to the Vary header of a response.
+
+    Args:
+        headers (list): the response (name, value) headers.
+
+    Returns:
+        list: the new response headers.
+    """
+    vary = [v for k, v in headers if k.lower() == 'vary']
+    if any('accept-encoding' in v.lower() or '*' in v for v in vary):
+        return headers
+    headers = [(k, v) for k, v in headers if k.lower() != 'vary']
+    headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+    return headers
+
+
+def weak_etag(etag):
+    """Turn an ETag into a weak one."""
+    return etag if etag.startswith('W/') else 'W/' + etag
+
+
+def precompress(static_folder, min_size=MIN_SIZE):
+    """Create the precompressed siblings of the static files.
+
+    Siblings up to date with their files are kept. The brotli siblings are
+    created only if the brotli package is installed.
+
+    Args:
+        static_folder (str): the static files folder.
+        min_size (int): the smallest file compressed, in bytes.
+        Default value is MIN_SIZE.
+
+    Returns:
+        int: the number of siblings created.
+    """
+    count = 0
+    extensions = tuple(ext for _, ext in STATIC_ENCODINGS)
+    for folder, _, files in os.walk(static_folder):
+        for name in files:
+            filename = os.path.join(folder, name)
+            if (name.endswith(extensions) or
+                    not is_compressible(mimetypes.guess_type(name)[0]) or
+                    os.path.getsize(filename) < min_size):
+                continue
+            with open(filename, 'rb') as f:
+                data = f.read()
+            for encoding, ext in STATIC_ENCODINGS:
+                sibling = filename + ext
+                if (encoding == 'br' and brotli is None) or (
+                        os.path.isfile(sibling) and
+                        os.path.getmtime(sibling) >=
+                        os.path.getmtime(filename)):
+                    continue
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                # Only keep siblings that are actually smaller
+                if len(compressed) < len(data):
+                    with open(sibling, 'wb') as f:
+                        f.write(compressed)
+                    count += 1
+    return count
+
+
+# When running this module from command line it will precompress the static
+# files.
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'static')
+    print('{} precompressed files created.'.format(precompress(folder)))
@@ -0,0 +1,61 @@
+"""Utility module to reset the process resources inherited by forked workers.
+
+Preloading WSGI servers import the app and then fork the workers. Resources
+created at import time, like thread pools, HTTP sessions and listening
+connections, are then shared by the parent and all the workers, so each
+module registers with after_fork the function recreating its own.
+
+The functions run in the child right after the fork when the Python version
+has os.register_at_fork (3.7 and later). On older versions the fork is
+detected by the process id changing, when check_fork is called before the
+resources are used, like at the start of every request.
+"""
+
+from threading import Lock
+import os
+
+
+_callbacks = []
+_pid = os.getpid()
+_lock = Lock()
+
+
+def _run_callbacks():
+    """Run the after fork functions in the child process."""
+    global _pid, _lock
+    _pid = os.getpid()
+    # The lock may have been held by a parent thread at fork time
+    _lock = Lock()
+    for callback in _callbacks:
+        callback()
+
+
+def after_fork(callback):
+    """Register a function to be run in forked child processes.
+
+    It can be used as a decorator.
+
+    Args:
+        callback: the function, called without arguments.
+
+    Returns:
+        The function itself.
+    """
+    _callbacks.append(callback)
+    return callback
+
+
+def check_fork():
+    """Run the after fork functions if the process forked since last run.
+
+    It's cheap enough to be called before every request. It does nothing
+    when the functions already ran at fork time.
+    """
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                _run_callbacks()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_run_callbacks)
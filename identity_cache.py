@@ -0,0 +1,97 @@
+"""Utility module to cache the identity of the logged users.
+
+The JWT user loader runs on every protected or jwt optional request. Instead
+of loading the user from DB every time, a lightweight immutable snapshot of
+the user is kept in a bounded TTL cache keyed by the user id.
+
+The entries must be invalidated whenever the user data changes or the user
+logs out.
+"""
+
+from collections import namedtuple, OrderedDict
+from threading import Lock
+import time
+
+
+# The user fields needed by the views and templates
+UserSnapshot = namedtuple('UserSnapshot', [
+    'id', 'username', 'email', 'picture', 'provider', 'oauth_user_id',
+    'oauth_token'
+])
+
+# Maximum number of cached users and the time in seconds they're kept
+MAX_ENTRIES = 4096
+TTL = 60
+
+
+def snapshot(user):
+    """Build the snapshot of a user.
+
+    Args:
+        user (database.User): the user object database model.
+
+    Returns:
+        UserSnapshot: the user snapshot.
+    """
+    return UserSnapshot(*(getattr(user, f) for f in UserSnapshot._fields))
+
+
+class IdentityCache(object):
+    """Thread safe LRU cache of user snapshots with expiration time."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        """Create an empty cache.
+
+        Args:
+            max_entries (int): maximum number of cached users.
+            Default value is MAX_ENTRIES.
+            ttl (int): time in seconds a user is kept. Default value is TTL.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Get a cached user snapshot.
+
+        Args:
+            user_id (int): the user id.
+
+        Returns:
+            UserSnapshot: the user or None if it's not cached or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if time.monotonic() > expires:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user):
+        """Cache a user snapshot, evicting the least recently used ones.
+
+        Args:
+            user (UserSnapshot): the user snapshot.
+        """
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Remove a user from the cache.
+
+        Args:
+            user_id (int): the user id.
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache()
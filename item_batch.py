@@ -0,0 +1,162 @@
+"""Utility module to apply batches of item create, update and delete actions.
+
+All operations of a batch are validated and applied to the session together,
+so they're flushed and committed at once by the caller. A batch is atomic:
+if any operation is invalid, none is applied.
+
+Operation format:
+    {"op": "create", "category": ..., "name": ..., "description": ...}
+    {"op": "update", "category": ..., "name": ..., "new_name": ...,
+     "new_category": ..., "description": ...}
+    {"op": "delete", "category": ..., "name": ...}
+The update new_name, new_category and description keys are optional. All
+values must be strings, the description may also be null.
+"""
+
+from sqlalchemy import and_, or_
+
+from database import db_session, Item
+from category_registry import category_registry
+
+
+# Maximum number of operations accepted in a batch
+MAX_BATCH_OPERATIONS = 1000
+# Operation keys whose values must be strings, when given
+TEXT_FIELDS = ('category', 'name', 'new_name', 'new_category', 'description')
+
+
+class BatchChanges(object):
+    """The changes a batch made, needed after it's committed."""
+
+    def __init__(self):
+        """Create the empty changes record."""
+        # Category ids whose revision must be incremented
+        self.category_ids = set()
+        # (category name, item name) of the pages to invalidate
+        self.pages = set()
+
+
+def has_text_fields(op):
+    """Check that the operation values are strings or null.
+
+    Args:
+        op (dict): the operation.
+
+    Returns:
+        bool: True if they're all strings or null, False otherwise.
+    """
+    return all(op.get(f) is None or isinstance(op[f], str)
+               for f in TEXT_FIELDS)
+
+
+def load_targets(operations):
+    """Load in a single query the items updated or deleted by a batch.
+
+    Invalid operations are skipped, they're rejected by apply_operation.
+
+    Args:
+        operations (list): the batch operations.
+
+    Returns:
+        dict: the items by (category id, name).
+    """
+    keys = set()
+    for op in operations:
+        if not isinstance(op, dict) or not has_text_fields(op):
+            continue
+        cat = category_registry.get(op.get('category') or '')
+        if op.get('op') in ('update', 'delete') and cat and op.get('name'):
+            keys.add((cat.id, op['name']))
+    if not keys:
+        return {}
+
+    items = db_session.query(Item).filter(or_(*[
+        and_(Item.category_id == category_id, Item.name == name)
+        for category_id, name in keys]))
+    return {(i.category_id, i.name): i for i in items}
+
+
+def apply_operation(op, user_id, targets, changes):
+    """Validate and apply one operation to the session.
+
+    Args:
+        op (dict): the operation.
+        user_id (int): the id of the user sending the batch.
+        targets (dict): the existing items by (category id, name).
+        changes (BatchChanges): the batch changes, updated by the operation.
+
+    Returns:
+        A tuple with the operation result and the HTTP status of it.
+    """
+    kind = op.get('op')
+    if kind not in ('create', 'update', 'delete'):
+        return {'error': 'Unknown operation.'}, 400
+    if not has_text_fields(op):
+        return {'error': 'Invalid operation values.'}, 400
+    cat = category_registry.get(op.get('category') or '')
+    if cat is None:
+        return {'error': 'Unknown category.'}, 400
+    if not op.get('name'):
+        return {'error': 'Missing item name.'}, 400
+
+    if kind == 'create':
+        item = Item(name=op['name'], description=op.get('description'),
+                    category_id=cat.id, user_id=user_id)
+        db_session.add(item)
+        changes.category_ids.add(cat.id)
+        changes.pages.add((cat.name, item.name))
+        return {'result': 'created'}, 201
+
+    item = targets.get((cat.id, op['name']))
+    if item is None:
+        return {'error': 'Item not found.'}, 404
+    # Same ownership rule of the item edit and delete routes
+    if item.user_id != user_id:
+        return {'error': "Unauthorized. You can't change others user's "
+                         "item."}, 401
+
+    changes.category_ids.add(cat.id)
+    changes.pages.add((cat.name, item.name))
+    if kind == 'delete':
+        db_session.delete(item)
+        return {'result': 'deleted'}, 200
+
+    new_cat = cat
+    if op.get('new_category'):
+        new_cat = category_registry.get(op['new_category'])
+        if new_cat is None:
+            return {'error': 'Unknown new category.'}, 400
+    item.name = op.get('new_name') or item.name
+    item.description = op.get('description', item.description)
+    item.category_id = new_cat.id
+    changes.category_ids.add(new_cat.id)
+    changes.pages.add((new_cat.name, item.name))
+    return {'result': 'updated'}, 200
+
+
+def apply_batch(operations, user_id):
+    """Validate and apply the batch operations to the session.
+
+    Nothing is flushed. The caller must commit the session if the batch is
+    valid or roll it back otherwise.
+
+    Args:
+        operations (list): the batch operations.
+        user_id (int): the id of the user sending the batch.
+
+    Returns:
+        A tuple with the list of operations results, True if all of them
+        are valid, and the BatchChanges.
+    """
+    targets = load_targets(operations)
+    changes = BatchChanges()
+    results, valid = [], True
+    for n, op in enumerate(operations):
+        if not isinstance(op, dict):
+            result, status = {'error': 'Invalid operation.'}, 400
+        else:
+            result, status = apply_operation(op, user_id, targets, changes)
+        result.update(index=n, status=status)
+        results.append(result)
+        valid = valid and status < 400
+    return results, valid, changes
@@ -0,0 +1,114 @@
+"""Utility module to encode the API responses in JSON format.
+
+Documents are encoded by orjson when it's installed, falling back to the
+standard json module otherwise. The API end points select only the requested
+columns as plain row tuples, so no ORM object is built just to be
+serialized, and clients may skip the columns they don't need, like the item
+description, with the fields query argument:
+
+    /catalog/api/v1/Soccer.json?fields=id,name
+"""
+
+import json
+
+from flask import Response
+
+from database import Item
+
+# Optional dependency. The standard json module is used without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Item columns that can be sent by the API, in the order they're sent
+ITEM_FIELDS = ('id', 'name', 'description', 'category_id', 'user_id')
+
+
+class InvalidFields(ValueError):
+    """Raised when the fields query argument has unknown fields."""
+
+
+def dumps(obj):
+    """Encode a document in JSON format.
+
+    Args:
+        obj: the document, made of dicts, lists, strings, numbers and None.
+
+    Returns:
+        bytes: the document encoded in UTF-8.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    """Build a response with a document in JSON format.
+
+    Args:
+        obj: the document.
+        status (int): the HTTP status. Default value is 200.
+
+    Returns:
+        The Flask response.
+    """
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def parse_fields(value, allowed=ITEM_FIELDS):
+    """Parse the fields query argument.
+
+    Args:
+        value (str): the comma separated list of fields, or None or empty
+        for all of them.
+        allowed (tuple): the fields that can be requested.
+        Default value is ITEM_FIELDS.
+
+    Returns:
+        tuple: the requested fields in the allowed fields order.
+
+    Raises:
+        InvalidFields: if any field isn't allowed.
+    """
+    requested = set(f.strip() for f in (value or '').split(',') if f.strip())
+    if not requested:
+        return allowed
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise InvalidFields('Unknown fields: {}.'.format(
+            ', '.join(sorted(unknown))))
+    return tuple(f for f in allowed if f in requested)
+
+
+def item_columns(fields):
+    """Get the item columns to select for the requested fields.
+
+    The item id is always selected, after the requested fields, since the
+    pagination needs it.
+
+    Args:
+        fields (tuple): the requested item fields.
+
+    Returns:
+        list: the Item columns.
+    """
+    columns = [getattr(Item, f) for f in fields]
+    if 'id' not in fields:
+        columns.append(Item.id)
+    return columns
+
+
+def row_dicts(rows, fields):
+    """Build the documents of the rows selected by item_columns.
+
+    Args:
+        rows: the row tuples.
+        fields (tuple): the requested item fields.
+
+    Returns:
+        list: a dict per row with the requested fields.
+    """
+    return [dict(zip(fields, row)) for row in rows]
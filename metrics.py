@@ -0,0 +1,243 @@
+"""Utility module to collect the application metrics.
+
+It records, per route endpoint:
+    the request latency histogram;
+    the request count by response status;
+    the number of SQL statements and the time spent on them.
+
+And also the number of requests in progress and the DB connection pools
+gauges. All metrics are exposed in Prometheus text format by the /metrics
+route.
+"""
+
+from collections import defaultdict
+from threading import Lock
+import bisect
+import time
+
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+
+from database import engine, replica_engines, pool_stats
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, float('inf'))
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Create an empty histogram.
+
+        Args:
+            buckets (tuple): the sorted buckets upper bounds, ending with
+            infinity. Default value is LATENCY_BUCKETS.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Get the (upper bound, cumulative count) of every bucket."""
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """Thread safe store of the requests and SQL statements metrics."""
+
+    def __init__(self):
+        """Create the metrics with all counters zeroed."""
+        self.latency = defaultdict(Histogram)
+        self.statuses = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.db_time = defaultdict(float)
+        self.in_flight = 0
+        self._lock = Lock()
+
+    def request_started(self):
+        """Record a request start."""
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, endpoint, status, seconds, queries, db_time):
+        """Record a finished request.
+
+        Args:
+            endpoint (str): the route endpoint name.
+            status (int): the response status code.
+            seconds (float): the request latency.
+            queries (int): the number of SQL statements executed.
+            db_time (float): the time spent executing them, in seconds.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.latency[endpoint].observe(seconds)
+            self.statuses[(endpoint, status)] += 1
+            self.queries[endpoint] += queries
+            self.db_time[endpoint] += db_time
+
+    def render(self):
+        """Render the metrics in Prometheus text format.
+
+        Returns:
+            str: the metrics text.
+        """
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        with self._lock:
+            metric('http_request_duration_seconds', 'histogram',
+                   'Request latency by route endpoint.')
+            for endpoint, h in sorted(self.latency.items()):
+                for bound, count in h.cumulative():
+                    lines.append(
+                        'http_request_duration_seconds_bucket'
+                        '{{endpoint="{}",le="{}"}} {}'.format(
+                            endpoint, format_bound(bound), count))
+                lines.append('http_request_duration_seconds_sum'
+                             '{{endpoint="{}"}} {}'.format(endpoint, h.sum))
+                lines.append('http_request_duration_seconds_count'
+                             '{{endpoint="{}"}} {}'.format(endpoint, h.count))
+
+            metric('http_requests_total', 'counter',
+                   'Requests by route endpoint and response status.')
+            for (endpoint, status), count in sorted(self.statuses.items()):
+                lines.append('http_requests_total{{endpoint="{}",status="{}"}}'
+                             ' {}'.format(endpoint, status, count))
+
+            metric('http_requests_in_flight', 'gauge',
+                   'Requests in progress.')
+            lines.append('http_requests_in_flight {}'.format(self.in_flight))
+
+            metric('db_queries_total', 'counter',
+                   'SQL statements executed by route endpoint.')
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append('db_queries_total{{endpoint="{}"}} {}'.format(
+                    endpoint, count))
+
+            metric('db_query_seconds_total', 'counter',
+                   'Time spent executing SQL statements by route endpoint.')
+            for endpoint, seconds in sorted(self.db_time.items()):
+                lines.append('db_query_seconds_total{{endpoint="{}"}} '
+                             '{}'.format(endpoint, seconds))
+
+        render_pools(lines, metric)
+        return '\n'.join(lines) + '\n'
+
+
+def format_bound(bound):
+    """Format a histogram upper bound as Prometheus expects."""
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render_pools(lines, metric):
+    """Add the DB connection pools metrics to the lines being rendered."""
+    pools = [('primary', engine)] + [
+        ('replica{}'.format(n), e) for n, e in enumerate(replica_engines)]
+    stats = [(name, pool_stats(e)) for name, e in pools]
+
+    for key, kind, help_text in (
+            ('in_use', 'gauge', 'Connections checked out.'),
+            ('idle', 'gauge', 'Connections idle in the pool.'),
+            ('overflow', 'gauge', 'Overflow connections open.'),
+            ('overflow_total', 'counter', 'Checkouts that opened overflow '
+                                          'connections.'),
+            ('timeouts', 'counter', 'Checkouts that timed out.')):
+        metric('db_pool_' + key, kind, help_text)
+        for name, s in stats:
+            lines.append('db_pool_{}{{pool="{}"}} {}'.format(
+                key, name, s[key]))
+
+    metric('db_pool_checkout_wait_seconds', 'histogram',
+           'Time waited for a pool connection.')
+    for name, s in stats:
+        for bound, count in s['checkout_wait_buckets']:
+            lines.append('db_pool_checkout_wait_seconds_bucket'
+                         '{{pool="{}",le="{}"}} {}'.format(
+                             name, format_bound(bound), count))
+        lines.append(
+            'db_pool_checkout_wait_seconds_sum{{pool="{}"}} {}'.format(
+                name, s['checkout_wait_sum']))
+        lines.append(
+            'db_pool_checkout_wait_seconds_count{{pool="{}"}} {}'.format(
+                name, s['checkout_wait_count']))
+
+
+metrics = Metrics()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Record the start time of a SQL statement."""
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    """Attribute a finished SQL statement to the current request."""
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_db_time += elapsed
+
+
+def init_metrics(app, engines=None):
+    """Register the metrics hooks and the /metrics route in the app.
+
+    Args:
+        app: the Flask application.
+        engines (list): the SQLAlchemy engines to instrument. Default is the
+        primary engine and the read replicas.
+    """
+    # The engines are shared by every app created in the process, so their
+    # statements are only counted once
+    for e in engines or [engine] + replica_engines:
+        if event.contains(e, 'before_cursor_execute', before_cursor_execute):
+            continue
+        event.listen(e, 'before_cursor_execute', before_cursor_execute)
+        event.listen(e, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        metrics.request_started()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request(exception=None):
+        if 'metrics_start' not in g:
+            return
+        metrics.request_finished(
+            request.endpoint or 'not_found',
+            g.get('metrics_status', 500),
+            time.perf_counter() - g.metrics_start,
+            g.metrics_queries, g.metrics_db_time)
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Expose the metrics in Prometheus text format."""
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
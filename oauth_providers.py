@@ -7,12 +7,234 @@ It includes:
 """
 
 from flask import g, jsonify
-from oauth2client.client import flow_from_clientsecrets, FlowExchangeError
+from oauth2client.client import OAuth2WebServerFlow, FlowExchangeError
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from threading import Lock
+import httplib2
 import json
 import requests
 import os
+import signal
+import time
 
 from database import db_session, User
+from fork_safety import after_fork
+from identity_cache import identity_cache
+
+
+# Outbound HTTP settings. A slow provider must not pin a worker indefinitely.
+# Seconds to connect and to wait for the response of each provider request
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', 3))
+HTTP_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', 10))
+# Number of retries of failed connections and 5xx responses
+HTTP_RETRIES = int(os.environ.get('OAUTH_HTTP_RETRIES', 2))
+# Keep-alive connections kept per provider host
+HTTP_POOL_SIZE = int(os.environ.get('OAUTH_HTTP_POOL_SIZE', 10))
+
+
+def create_http_session():
+    """Create the HTTP session shared by all provider requests.
+
+    The session keeps alive the connections to the providers hosts and
+    retries idempotent requests on connection errors and 5xx responses.
+
+    Returns:
+        requests.Session: the HTTP session.
+    """
+    session = requests.Session()
+    retry = Retry(total=HTTP_RETRIES, backoff_factor=0.2,
+                  status_forcelist=(500, 502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http = create_http_session()
+
+# Threads to run independent provider requests concurrently
+executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
+
+
+@after_fork
+def recreate_after_fork():
+    """Create the HTTP session and threads of a forked process.
+
+    The threads don't survive the fork and the session connections are
+    shared with the parent process.
+    """
+    global http, executor
+    http = create_http_session()
+    executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
+
+
+# Folder and files of the providers client secrets
+SECRETS_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static', 'json')
+SECRETS_FILES = {
+    'google': 'google_client_secrets.json',
+    'facebook': 'facebook_client_secrets.json'
+}
+# Minimum seconds between checks of the client secrets files modification
+CONFIG_CHECK_INTERVAL = 30
+
+
+class ProviderConfig(object):
+    """Registry of the OAuth providers client configuration.
+
+    Each provider client secrets file is parsed once, when first needed, and
+    kept in memory together with the objects built from it, like the Google
+    OAuth flow. A provider configuration is reloaded when its file is
+    modified or when the process receives SIGHUP.
+    """
+
+    def __init__(self, folder=SECRETS_FOLDER,
+                 check_interval=CONFIG_CHECK_INTERVAL):
+        """Create the registry. The configurations are loaded lazily.
+
+        Args:
+            folder (str): the client secrets files folder.
+            Default value is SECRETS_FOLDER.
+            check_interval (int): minimum seconds between file modification
+            checks. Default value is CONFIG_CHECK_INTERVAL.
+        """
+        self.folder = folder
+        self.check_interval = check_interval
+        self._configs = {}
+        self._mtimes = {}
+        self._checked = time.monotonic()
+        self._lock = Lock()
+
+    def get(self, provider):
+        """Get a provider configuration.
+
+        Args:
+            provider (str): the provider name, google or facebook.
+
+        Returns:
+            dict: the web section of the provider client secrets. The Google
+            configuration also has the prepared OAuth flow in flow key.
+        """
+        if time.monotonic() > self._checked + self.check_interval:
+            self._check_files()
+        config = self._configs.get(provider)
+        if config is None:
+            with self._lock:
+                config = self._configs.get(provider)
+                if config is None:
+                    config = self._load(provider)
+        return config
+
+    def reload(self, *args):
+        """Discard all configurations, so they're reloaded when needed.
+
+        The lock isn't acquired, since this may run as a signal handler
+        interrupting a thread that holds it.
+        """
+        self._configs = {}
+        self._mtimes = {}
+
+    def _path(self, provider):
+        """Get the client secrets file path of a provider."""
+        return os.path.join(self.folder, SECRETS_FILES[provider])
+
+    def _check_files(self):
+        """Discard the configurations whose files were modified."""
+        self._checked = time.monotonic()
+        with self._lock:
+            for provider, mtime in list(self._mtimes.items()):
+                try:
+                    modified = os.stat(self._path(provider)).st_mtime_ns
+                except FileNotFoundError:
+                    modified = None
+                if modified != mtime:
+                    self._configs.pop(provider, None)
+                    self._mtimes.pop(provider, None)
+
+    def _load(self, provider):
+        """Load a provider configuration. The lock must be held."""
+        path = self._path(provider)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'r') as f:
+            config = json.load(f)['web']
+
+        if provider == 'google':
+            uris = {k: config[k] for k in ('auth_uri', 'token_uri',
+                                           'revoke_uri') if k in config}
+            config['flow'] = OAuth2WebServerFlow(
+                client_id=config['client_id'],
+                client_secret=config['client_secret'],
+                scope='', redirect_uri='postmessage', **uris)
+
+        self._configs[provider] = config
+        self._mtimes[provider] = mtime
+        return config
+
+
+provider_config = ProviderConfig()
+
+# Reload the configuration on SIGHUP, when signals can be handled
+try:
+    signal.signal(signal.SIGHUP, provider_config.reload)
+except (AttributeError, ValueError):
+    pass
+
+
+def http_get(url, params):
+    """Send a GET request to a provider through the shared session.
+
+    Args:
+        url (str): the request URL.
+        params (dict): the query string parameters.
+
+    Returns:
+        requests.Response: the provider response.
+    """
+    return http.get(url, params=params,
+                    timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+
+class SessionHttp(object):
+    """httplib2 compatible client sending requests through the shared session.
+
+    The oauth2client library requests with an httplib2.Http interface. This
+    adapter gives its requests the pooled connections, timeouts and retries
+    of the shared session.
+    """
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        """Send a request, like httplib2.Http.request.
+
+        Returns:
+            A tuple with the httplib2.Response and the response content.
+
+        Raises:
+            requests.exceptions.RequestException: if the request failed.
+        """
+        result = http.request(
+            method, uri, data=body, headers=headers,
+            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        info = dict(result.headers, status=str(result.status_code))
+        return httplib2.Response(info), result.content
+
+
+def provider_unavailable(error):
+    """Build the failure result of a provider request that didn't complete.
+
+    Args:
+        error (requests.exceptions.RequestException): the request error.
+
+    Returns:
+        dict: the error message and status code.
+    """
+    return {
+        'error': 'OAuth provider unavailable: {}'.format(error),
+        'status': 504
+    }
 
 
 def oauth_google(code):
@@ -36,45 +258,49 @@ def oauth_google(code):
     if code:
         try:
             # Upgrade the auth code for a credentials object
-            folder_path = os.path.dirname(os.path.abspath(__file__))
-            file_path = folder_path + '/static/json/google_client_secrets.json'
-            oauth_flow = flow_from_clientsecrets(file_path, scope='')
-            oauth_flow.redirect_uri = 'postmessage'
-            credentials = oauth_flow.step2_exchange(code)
+            oauth_flow = provider_config.get('google')['flow']
+            credentials = oauth_flow.step2_exchange(code, http=SessionHttp())
         except FlowExchangeError:
             return {
                 'error': 'Failed to upgrade the authorization code.',
                 'status': 401
             }
+        except requests.exceptions.RequestException as e:
+            return provider_unavailable(e)
     else:
         return {
             'error': 'No authorization code received from client.',
             'status': 401
         }
 
-    # Check that the access token is valid.
-    url = 'https://www.googleapis.com/oauth2/v1/tokeninfo?'
+    # Check that the access token is valid and get the user info. Both only
+    # depend on the access token, so they're requested concurrently.
     params = {'access_token': credentials.access_token, 'alt': 'json'}
+    token_info = executor.submit(
+        http_get, 'https://www.googleapis.com/oauth2/v1/tokeninfo', params)
+    user_info = executor.submit(
+        http_get, 'https://www.googleapis.com/oauth2/v1/userinfo', params)
     try:
-        result = requests.get(url, params=params)
+        result = token_info.result()
         result.raise_for_status()
     except requests.exceptions.HTTPError:
         return {
             'error': 'Error with the access token:\n{}'.format(result.json()),
             'status': result.status_code
         }
+    except requests.exceptions.RequestException as e:
+        return provider_unavailable(e)
 
-    # Get user info
-    url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
     try:
-        result = requests.get(url, params=params)
+        result = user_info.result()
         result.raise_for_status()
     except requests.exceptions.HTTPError:
         return {
             'error': 'Error getting user info:\n{}'.format(result.json()),
             'status': result.status_code
         }
+    except requests.exceptions.RequestException as e:
+        return provider_unavailable(e)
 
     # Return the user data and auth token compiled together in a dict
     data = {'user': result.json(), 'token': credentials.access_token}
@@ -98,11 +324,9 @@ def oauth_facebook(access_token):
         In case of failure, an error message and status code is returned.
             Format: {'error': ..., 'status': ...}
     """
-    folder_path = os.path.dirname(os.path.abspath(__file__))
-    file_path = folder_path + '/static/json/facebook_client_secrets.json'
-    client_secrets = json.loads(open(file_path, 'r').read())
-    app_id = client_secrets['web']['app_id']
-    app_secret = client_secrets['web']['app_secret']
+    client_secrets = provider_config.get('facebook')
+    app_id = client_secrets['app_id']
+    app_secret = client_secrets['app_secret']
 
     # Exchange for a token
     url = 'https://graph.facebook.com/oauth/access_token'
@@ -111,7 +335,10 @@ def oauth_facebook(access_token):
         'client_id': app_id,
         'client_secret': app_secret,
         'fb_exchange_token': access_token}
-    result = requests.get(url, params=params).json()
+    try:
+        result = http_get(url, params).json()
+    except requests.exceptions.RequestException as e:
+        return provider_unavailable(e)
 
     # If there was an error in the access token info, abort.
     if result.get('error') is not None:
@@ -120,17 +347,24 @@ def oauth_facebook(access_token):
             'status': 401
         }
 
-    # Use token to get user info from API
+    # Use token to get user info and picture from API concurrently
     token = result.get('access_token')
     url = 'https://graph.facebook.com/v3.2/me'
     params = {'access_token': token, 'fields': 'name,id,email'}
-    user_data = requests.get(url, params=params).json()
+    user_request = executor.submit(http_get, url, params)
 
-    # Get user picture and add to the current data dictionary
     url = 'https://graph.facebook.com/v3.2/me/picture'
     params = {'access_token': token, 'redirect': '0', 'height': '200',
               'width': '200'}
-    picture = requests.get(url, params=params).json()
+    picture_request = executor.submit(http_get, url, params)
+
+    try:
+        user_data = user_request.result().json()
+        picture = picture_request.result().json()
+    except requests.exceptions.RequestException as e:
+        return provider_unavailable(e)
+
+    # Add the user picture to the current data dictionary
     user_data['picture'] = picture["data"]["url"]
 
     # Return the user data and auth token compiled together in a dict
@@ -150,15 +384,19 @@ def oauth_disconnect():
         return jsonify(error='Current user not connected.'), 401
 
     result = {}
-    if g.user.provider == 'google':
-        url = 'https://accounts.google.com/o/oauth2/revoke'
-        params = {'token': g.user.oauth_token, 'alt': 'json'}
-        result = requests.get(url, params=params).json()
-    elif g.user.provider == 'facebook':
-        facebook_id = g.user.oauth_user_id
-        url = 'https://graph.facebook.com/%s/permissions?access_token=%s'\
-              % (facebook_id, g.user.oauth_token)
-        result = requests.delete(url).json()
+    try:
+        if g.user.provider == 'google':
+            url = 'https://accounts.google.com/o/oauth2/revoke'
+            params = {'token': g.user.oauth_token, 'alt': 'json'}
+            result = http_get(url, params).json()
+        elif g.user.provider == 'facebook':
+            facebook_id = g.user.oauth_user_id
+            url = 'https://graph.facebook.com/%s/permissions?access_token=%s'\
+                  % (facebook_id, g.user.oauth_token)
+            result = http.delete(
+                url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)).json()
+    except requests.exceptions.RequestException as e:
+        return provider_unavailable(e)
 
     if result.get('error') is None:
         return {
@@ -185,9 +423,10 @@ def register_oauth_user(user):
     """
     old_user = db_session.query(User).filter_by(email=user.email).first()
     if not old_user:
-        user.hash_password("")
+        # Oauth users have no site password, so nothing is hashed
         db_session.add(user)
         db_session.commit()
+        identity_cache.invalidate(user.id)
         return user
     else:
         # Updating DB fields in case the values has changed since user
@@ -200,4 +439,6 @@ def register_oauth_user(user):
         old_user.oauth_token = user.oauth_token
         db_session.add(old_user)
         db_session.commit()
+        # The cached snapshot has the old user data
+        identity_cache.invalidate(old_user.id)
         return old_user
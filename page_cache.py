@@ -0,0 +1,196 @@
+"""Utility module to cache the rendered HTML of the read only pages.
+
+The catalog, category and item pages only change when an item is added,
+edited or deleted. So their rendered HTML is stored in a size bounded LRU
+cache, keyed by the request path and the authentication state, and the
+entries are invalidated by the write routes right after they commit.
+
+Every cached page is tagged, for example with the category or item name it
+shows, so a write only drops the pages that may display the changed item.
+
+The invalidation only reaches the cache of the process that made the write.
+So item writes, including bulk imports, also notify the other processes
+through a change notifier, like the category registry does. Every page is
+stored with the notifier version it was rendered at, and it's served only
+while the version is the same. Reading the version costs no DB query: it's
+a poll of the LISTEN connection or a notification file stat.
+"""
+
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+import time
+
+from flask import g, request
+
+from category_registry import create_notifier
+from database import db_session
+from fork_safety import after_fork
+from query_loading import PRIMARY_READS_WINDOW
+
+
+# Maximum number of cached pages and total size of cached HTML in characters
+MAX_ENTRIES = 1024
+MAX_SIZE = 32 * 1024 * 1024
+# Notification channel of the item writes
+CHANNEL = 'item_changed'
+
+
+class PageCache(object):
+    """Thread safe LRU cache of rendered pages with tag invalidation."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_size=MAX_SIZE):
+        """Create an empty cache.
+
+        Args:
+            max_entries (int): maximum number of cached pages.
+            Default value is MAX_ENTRIES.
+            max_size (int): maximum total length of the cached pages.
+            Default value is MAX_SIZE.
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.invalidated_at = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = Lock()
+
+    def get(self, key, revision=None):
+        """Get a cached page and mark it as the most recently used.
+
+        Args:
+            key: the page cache key.
+            revision: the current version of the data shown by the page.
+            A page stored with another version is removed.
+
+        Returns:
+            str: the rendered page or None if it's not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] != revision:
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, page, tags, revision=None):
+        """Store a rendered page, evicting the least recently used ones.
+
+        Args:
+            key: the page cache key.
+            page (str): the rendered page.
+            tags (iterable): the tags to invalidate the page with.
+            revision: the version of the data shown by the page.
+        """
+        if len(page) > self.max_size:
+            return
+        with self._lock:
+            self._discard(key)
+            tags = frozenset(tags)
+            self._entries[key] = (page, tags, revision)
+            self.size += len(page)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_size):
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        """Remove every cached page marked with any of the tags.
+
+        Args:
+            tags: the tags of the pages to be removed.
+        """
+        with self._lock:
+            self.invalidated_at = time.time()
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._discard(key)
+
+    def clear(self):
+        """Remove every cached page."""
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        """Remove a page and its tag references. The lock must be held."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        page, tags, _ = entry
+        self.size -= len(page)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+page_cache = PageCache()
+page_notifier = create_notifier(channel=CHANNEL)
+
+# Each forked process listens to the notifications on its own connection
+if hasattr(page_notifier, 'after_fork'):
+    after_fork(page_notifier.after_fork)
+
+
+def cached_page(tags):
+    """Decorator to serve a view rendered HTML from the page cache.
+
+    It must be applied below the JWT decorators, so the logged user is
+    already set in g when the cache key is built. Anonymous visitors share
+    the same entries while logged users get their own, since item owners see
+    the edit and delete buttons. Pages are served only while no item write
+    was notified since they were rendered.
+
+    Args:
+        tags: function receiving the view arguments and returning the tags
+        to invalidate the page with.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user = g.get('user')
+            key = (request.full_path, user.id if user else None)
+            revision = page_notifier.version()
+            page = page_cache.get(key, revision)
+            if page is None:
+                page = view(*args, **kwargs)
+                # A page read from a replica right after a write may still
+                # miss the change, so it's not stored until replicas catch up
+                if (not db_session().use_replica or
+                        time.time() - page_cache.invalidated_at >
+                        PRIMARY_READS_WINDOW):
+                    page_cache.set(key, page, tags(*args, **kwargs),
+                                   revision)
+            return page
+        return wrapper
+    return decorator
+
+
+def invalidate_item_pages(category, item):
+    """Remove the cached pages of this process that may show an item.
+
+    To be called after an item write is committed, followed by a single
+    notify_item_writes call for the whole write.
+
+    Args:
+        category (str): the item category name.
+        item (str): the item name.
+    """
+    page_cache.invalidate('catalog', 'category:' + category, 'item:' + item)
+
+
+def notify_item_writes():
+    """Notify the page caches of every process that items changed.
+
+    To be called after an item write is committed.
+    """
+    page_notifier.notify()
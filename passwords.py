@@ -0,0 +1,119 @@
+"""Utility module to hash and verify the user passwords in a worker pool.
+
+Password hashing is deliberately CPU heavy. Running it inline in the request
+threads would starve every other request of the worker during a login burst.
+So hashes are computed in a bounded process pool, and requests wait for a
+free slot only for a limited time before being rejected.
+
+The hash cost is configurable. Hashes created with other settings are
+transparently replaced when the user logs in.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+from threading import BoundedSemaphore, Lock
+import os
+
+from fork_safety import after_fork
+
+# Hashing cost, the number of sha512_crypt rounds
+PASSWORD_ROUNDS = int(os.environ.get('PASSWORD_ROUNDS', 656000))
+# Worker processes computing hashes
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', os.cpu_count() or 1))
+# Maximum hashes queued or running. Beyond that, requests wait for a slot
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING',
+                                          4 * PASSWORD_WORKERS))
+# Seconds a request waits for a free slot before being rejected
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_QUEUE_TIMEOUT', 5))
+
+# sha256_crypt is kept to verify hashes created by passlib's
+# custom_app_context on 32 bits systems. They're rehashed on login.
+pswd_context = CryptContext(schemes=['sha512_crypt', 'sha256_crypt'],
+                            default='sha512_crypt',
+                            deprecated=['sha256_crypt'],
+                            sha512_crypt__default_rounds=PASSWORD_ROUNDS,
+                            # Hashes with fewer rounds are rehashed on login
+                            sha512_crypt__min_rounds=PASSWORD_ROUNDS)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated for too long."""
+
+
+_executor = None
+_executor_lock = Lock()
+_slots = BoundedSemaphore(PASSWORD_MAX_PENDING)
+
+
+@after_fork
+def _reset_after_fork():
+    """Drop the hashing pool inherited by a forked process.
+
+    Its worker processes belong to the parent, the child starts its own pool
+    when first needed.
+    """
+    global _executor, _executor_lock, _slots
+    _executor = None
+    _executor_lock = Lock()
+    _slots = BoundedSemaphore(PASSWORD_MAX_PENDING)
+
+
+def _hash(password):
+    """Hash a password. Runs in the worker processes."""
+    return pswd_context.hash(password)
+
+
+def _verify_and_update(password, password_hash):
+    """Verify a password and rehash it if needed. Runs in the workers."""
+    return pswd_context.verify_and_update(password, password_hash)
+
+
+def _run(function, *args):
+    """Run a function in the hashing pool, waiting for its result.
+
+    Raises:
+        PasswordHashingBusy: if no pool slot is freed in time.
+    """
+    global _executor
+    if not _slots.acquire(timeout=PASSWORD_QUEUE_TIMEOUT):
+        raise PasswordHashingBusy()
+    try:
+        if _executor is None:
+            with _executor_lock:
+                if _executor is None:
+                    _executor = ProcessPoolExecutor(PASSWORD_WORKERS)
+        return _executor.submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """Hash a password with the configured cost.
+
+    Args:
+        password (str): the user password.
+
+    Returns:
+        str: the password hash.
+
+    Raises:
+        PasswordHashingBusy: if the hashing pool is saturated.
+    """
+    return _run(_hash, password)
+
+
+def verify_password(password, password_hash):
+    """Verify a password against its hash.
+
+    Args:
+        password (str): the password to be verified.
+        password_hash (str): the stored hash.
+
+    Returns:
+        A tuple with True for success, False otherwise, and the new hash if
+        the stored one must be replaced, or None.
+
+    Raises:
+        PasswordHashingBusy: if the hashing pool is saturated.
+    """
+    return _run(_verify_and_update, password, password_hash)
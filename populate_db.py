@@ -4,7 +4,8 @@
 
 import json
 
-from database import db_session, User, Category, Item
+from database import db_session, User
+from bulk_catalog import expand_category, import_catalog
 
 
 def populate_db():
@@ -68,17 +69,9 @@ def populate_db():
     db_session.add(user)
     db_session.commit()
 
-    for c in catalog_json['Catalog']:
-        category = Category(name=c['category'])
-        db_session.add(category)
-        db_session.commit()
-        for i in c['Item']:
-            item = Item(name=i['name'],
-                        description=i['description'],
-                        category_id=category.id,
-                        user_id=user.id)
-            db_session.add(item)
-            db_session.commit()
+    # Categories and items are inserted in batches in a single transaction
+    records = (r for c in catalog_json['Catalog'] for r in expand_category(c))
+    import_catalog(records, user.id)
 
     print('Database populated.')
 
@@ -0,0 +1,206 @@
+"""Utility module to declare how each route loads its database rows.
+
+Every view that renders or serializes items declares here which
+relationships must be eagerly loaded and how many SQL statements a single
+request to it is allowed to issue. This way the templates can freely access
+relationships like item.category.name without triggering one lazy SELECT per
+rendered item (the N+1 query problem).
+
+It includes:
+    the loading policy (eager options and query budget) of each route;
+    a helper to build a route query with its eager options applied;
+    keyset pagination of item queries;
+    routing of the read only routes queries to the DB read replicas;
+    the item lookup by category and name;
+    context managers to count and assert the queries issued by a route.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, contains_eager
+import time
+
+from flask import session
+
+from database import db_session, engine, Item
+from category_registry import category_registry
+
+
+# The loading options of a route and the maximum number of SQL statements a
+# request to it may issue. The budget includes the user lookup performed by
+# the JWT user loader on protected or jwt optional routes and, on the API
+# end points, the category revision lookup of conditional requests. It
+# doesn't include the category registry reload, made once per registry TTL
+# and not on every request.
+LoadingPolicy = namedtuple('LoadingPolicy', ['options', 'budget'])
+
+LOADING_POLICIES = {
+    # Cards read item.category.name, load it in the same SELECT
+    'catalog': LoadingPolicy((joinedload(Item.category),), 2),
+    # Items are already joined with Category to filter by its name
+    'category': LoadingPolicy((contains_eager(Item.category),), 2),
+    'item': LoadingPolicy((), 2),
+    'edit_item': LoadingPolicy((), 2),
+    'delete_item': LoadingPolicy((), 2),
+    'catalog_json': LoadingPolicy((), 4),
+    # The category is resolved by the category registry
+    'category_json': LoadingPolicy((), 3),
+    'item_json': LoadingPolicy((), 3),
+    # Ranked ids are searched first and then their items loaded
+    'search': LoadingPolicy((joinedload(Item.category),), 3),
+    'search_json': LoadingPolicy((), 3),
+}
+
+
+def route_query(route, *entities):
+    """Build a query with the eager loading options declared for a route.
+
+    Args:
+        route (str): the route endpoint name.
+        entities: the entities to be queried. Default is Item.
+
+    Returns:
+        A SQLAlchemy query object with the route loading options applied.
+    """
+    query = db_session.query(*(entities or (Item,)))
+    policy = LOADING_POLICIES.get(route)
+    if policy is not None and policy.options:
+        query = query.options(*policy.options)
+    return query
+
+
+def find_item(category, item, route, *entities):
+    """Find an item by its category and name.
+
+    The category id is resolved by the category registry, so the item is
+    found by a single probe of the unique (category_id, name) index.
+
+    Args:
+        category (str): the category name.
+        item (str): the item name.
+        route (str): the route endpoint name, for its loading options.
+        entities: the entities or columns to be queried. Default is Item.
+
+    Returns:
+        The item, or its row if columns were queried, or None if it's not
+        found.
+    """
+    cat = category_registry.get(category)
+    if cat is None:
+        return None
+    return route_query(route, *entities).filter(
+        Item.category_id == cat.id, Item.name == item).first()
+
+
+@contextmanager
+def count_queries(bind=engine):
+    """Record every SQL statement executed in the bind inside the block.
+
+    Args:
+        bind: the SQLAlchemy engine or connection to be listened.
+        Default is the application engine.
+
+    Yields:
+        list: the executed statements, filled while the block runs.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, 'before_cursor_execute', record)
+
+
+@contextmanager
+def assert_query_budget(route, bind=engine):
+    """Fail if the block issues more SQL statements than the route budget.
+
+    Intended for tests, wrapping a test client request to a route:
+
+        with assert_query_budget('catalog'):
+            client.get('/catalog')
+
+    The category registry is loaded before counting, so a reload due to a
+    cold or expired registry isn't charged to the route.
+
+    Args:
+        route (str): the route endpoint name declared in LOADING_POLICIES.
+        bind: the SQLAlchemy engine or connection to be listened.
+        Default is the application engine.
+
+    Raises:
+        AssertionError: if the route query budget was exceeded.
+    """
+    budget = LOADING_POLICIES[route].budget
+    category_registry.all()
+    with count_queries(bind) as statements:
+        yield statements
+    if len(statements) > budget:
+        raise AssertionError(
+            'Route {} issued {} queries, budget is {}:\n{}'.format(
+                route, len(statements), budget, '\n'.join(statements)))
+
+
+# Items per page on paginated routes and the maximum a client can ask for
+PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+def keyset_page(query, after=None, limit=PAGE_SIZE):
+    """Get a page of items using keyset pagination on the item id.
+
+    Instead of an OFFSET scan, the page starts right after the last item id
+    of the previous page, so every page costs the same index range read.
+
+    Args:
+        query: the item query to be paginated.
+        after (int): the last item id of the previous page. None for the
+        first page.
+        limit (int): the page size. It's bounded between 1 and MAX_PAGE_SIZE.
+        Default value is PAGE_SIZE.
+
+    Returns:
+        A tuple with the page item list and the id to request the next page
+        with, or None if this is the last page.
+    """
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    if after is not None:
+        query = query.filter(Item.id > after)
+    # Fetch one extra row only to know if there is a next page
+    items = query.order_by(Item.id).limit(limit + 1).all()
+    if len(items) > limit:
+        return items[:limit], items[limit - 1].id
+    return items, None
+
+
+# Seconds during which a user that wrote to the DB only reads from primary,
+# so replication lag doesn't hide the user's own changes
+PRIMARY_READS_WINDOW = 10
+
+
+def replica_reads(view):
+    """Decorator to send the view queries to the DB read replicas.
+
+    It must be applied only to views that don't write to the DB. Users that
+    wrote recently keep reading from the primary DB.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('primary_reads_until', 0) < time.time():
+            db_session().use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def mark_primary_reads():
+    """Make the current user read from the primary DB for a while.
+
+    To be called by the views after committing a write.
+    """
+    session['primary_reads_until'] = time.time() + PRIMARY_READS_WINDOW
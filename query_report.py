@@ -0,0 +1,180 @@
+"""Utility module to report the SQL statements executed by each request.
+
+When the diagnostic mode is enabled, by the QUERY_REPORT environment variable
+or app config, every statement executed during a request is captured. At the
+end of the request the statements are normalized and grouped, and repeated
+SELECTs, the signature of N+1 query patterns like a lazy loaded relationship
+inside a template loop, are flagged.
+
+The report summary is sent back in the X-Query-Report response header and
+the latest full reports are available as JSON in the /debug/queries route.
+Statements slower than SLOW_QUERY_SECONDS are logged with their EXPLAIN plan.
+"""
+
+from collections import deque, OrderedDict
+from threading import Lock
+import logging
+import os
+import re
+import time
+
+from flask import g, request, has_request_context, jsonify
+from sqlalchemy import event
+
+from database import engine, replica_engines
+
+
+logger = logging.getLogger(__name__)
+
+QUERY_REPORT = os.environ.get('QUERY_REPORT') == '1'
+# Statements slower than this are logged with their execution plan
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.1))
+# Times the same SELECT may run in a request before being flagged as N+1
+N_PLUS_ONE_THRESHOLD = 3
+# Number of full reports kept for the debug route
+REPORTS_KEPT = 50
+
+EXPLAIN = {'postgresql': 'EXPLAIN ', 'sqlite': 'EXPLAIN QUERY PLAN '}
+
+_whitespace = re.compile(r'\s+')
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+
+
+def normalize(statement):
+    """Reduce a statement to its shape, without literals and IN lists.
+
+    Args:
+        statement (str): the SQL statement.
+
+    Returns:
+        str: the normalized statement.
+    """
+    statement = _whitespace.sub(' ', statement).strip()
+    statement = _literals.sub('?', statement)
+    return _in_lists.sub('IN (...)', statement)
+
+
+def build_report(queries, threshold=N_PLUS_ONE_THRESHOLD):
+    """Group the executed statements and flag the N+1 patterns.
+
+    Args:
+        queries (list): the (statement, seconds) tuples, in execution order.
+        threshold (int): repetitions of a SELECT flagged as N+1.
+        Default value is N_PLUS_ONE_THRESHOLD.
+
+    Returns:
+        dict: the number of statements, the total time and the statement
+        groups, the N+1 ones also listed in n_plus_one.
+    """
+    groups = OrderedDict()
+    for statement, seconds in queries:
+        group = groups.setdefault(normalize(statement), {'count': 0,
+                                                         'seconds': 0.0})
+        group['count'] += 1
+        group['seconds'] += seconds
+
+    statements = [dict(statement=s, **group) for s, group in groups.items()]
+    return {
+        'count': len(queries),
+        'seconds': sum(seconds for _, seconds in queries),
+        'statements': statements,
+        'n_plus_one': [s for s in statements
+                       if s['count'] >= threshold and
+                       s['statement'].upper().startswith('SELECT')],
+    }
+
+
+def explain(conn, statement, parameters):
+    """Get the execution plan of a SELECT statement.
+
+    The plan is obtained through the DBAPI cursor, so it doesn't trigger the
+    SQLAlchemy events again.
+
+    Returns:
+        str: the plan or None if it's not available.
+    """
+    prefix = EXPLAIN.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    try:
+        cursor = conn.connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        plan = '\n'.join(' '.join(str(c) for c in row)
+                         for row in cursor.fetchall())
+        cursor.close()
+        return plan
+    except Exception as e:
+        return 'Plan not available: {}'.format(e)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Record the start time of a SQL statement."""
+    conn.info.setdefault('report_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    """Capture a finished SQL statement in the current request log."""
+    elapsed = time.perf_counter() - conn.info['report_start'].pop()
+    if not has_request_context() or 'query_log' not in g:
+        return
+    g.query_log.append((statement, elapsed))
+    if elapsed > SLOW_QUERY_SECONDS:
+        logger.warning('Slow query (%.1f ms) in %s:\n%s\nPlan:\n%s',
+                       elapsed * 1000, request.endpoint, statement,
+                       explain(conn, statement, parameters))
+
+
+reports = deque(maxlen=REPORTS_KEPT)
+_reports_lock = Lock()
+
+
+def init_query_report(app, engines=None):
+    """Register the query report hooks and debug route, if enabled.
+
+    Args:
+        app: the Flask application. The report is enabled by its
+        QUERY_REPORT config or the QUERY_REPORT environment variable.
+        engines (list): the SQLAlchemy engines to capture. Default is the
+        primary engine and the read replicas.
+    """
+    if not app.config.get('QUERY_REPORT', QUERY_REPORT):
+        return
+
+    # The engines are shared by every app created in the process, so their
+    # statements are only counted once
+    for e in engines or [engine] + replica_engines:
+        if event.contains(e, 'before_cursor_execute', before_cursor_execute):
+            continue
+        event.listen(e, 'before_cursor_execute', before_cursor_execute)
+        event.listen(e, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_query_log():
+        g.query_log = []
+
+    @app.after_request
+    def send_query_report(response):
+        if 'query_log' not in g:
+            return response
+        report = build_report(g.query_log)
+        report['path'] = request.full_path
+        report['endpoint'] = request.endpoint
+        with _reports_lock:
+            reports.append(report)
+
+        response.headers['X-Query-Report'] = 'count={}; ms={:.1f}; ' \
+            'n+1={}'.format(report['count'], report['seconds'] * 1000,
+                            len(report['n_plus_one']))
+        for s in report['n_plus_one']:
+            logger.warning('N+1 queries in %s: %d times %s',
+                           request.endpoint, s['count'], s['statement'])
+        return response
+
+    @app.route('/debug/queries')
+    def query_reports():
+        """Show the latest requests query reports in JSON format."""
+        with _reports_lock:
+            return jsonify(Reports=list(reports))
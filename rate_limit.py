@@ -0,0 +1,200 @@
+"""Utility module to limit the rate of requests per user and per client IP.
+
+Each limited route has a token bucket policy: a bucket holds at most burst
+tokens, refilled at rate tokens per second, and every request takes cost
+tokens from it. Requests finding the bucket without enough tokens are
+rejected with 429 Too Many Requests and a Retry-After header.
+
+Buckets are kept per route and per logged user, or per client IP for
+anonymous requests. They are stored in Redis and updated atomically by a Lua
+script, so all processes share them. Without REDIS_URL or the redis package,
+or while Redis is unreachable, buckets are kept in the process memory.
+"""
+
+from collections import namedtuple
+from functools import wraps
+from threading import Lock
+import math
+import os
+import time
+
+from flask import g, request, jsonify, after_this_request
+
+# Optional dependency. The in-memory buckets are used without it.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+REDIS_URL = os.environ.get('REDIS_URL')
+# Number of in-memory buckets above which the full ones are dropped
+MAX_MEMORY_BUCKETS = 10000
+
+# Token bucket settings: tokens per second, bucket size, request cost and
+# the limited request methods, None for all of them
+Policy = namedtuple('Policy', ['rate', 'burst', 'cost', 'methods'])
+
+POLICIES = {
+    # Password guessing and account creation, per client IP. Showing the
+    # forms isn't limited.
+    'site_login': Policy(0.2, 10, 1, ('POST',)),
+    'new_user': Policy(0.05, 5, 1, ('POST',)),
+    'oauth_login': Policy(0.2, 10, 1, None),
+    # The full catalog dump is the most expensive API response
+    'catalog_json': Policy(0.1, 5, 1, None),
+    'category_json': Policy(5, 30, 1, None),
+    'item_json': Policy(5, 30, 1, None),
+    'search_json': Policy(2, 20, 1, None),
+    'batch_items': Policy(1, 10, 1, None),
+    'changes_json': Policy(2, 20, 1, None),
+}
+
+# Atomically refill a bucket and take the request cost from it.
+# Returns if the request is allowed, the tokens left and the milliseconds to
+# wait before retrying.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) / 1000 * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(tokens), retry}
+"""
+
+
+class MemoryBuckets(object):
+    """Token buckets stored in the process memory."""
+
+    def __init__(self):
+        """Create the empty buckets storage."""
+        self._buckets = {}
+        self._lock = Lock()
+
+    def take(self, key, policy):
+        """Take the request cost from a bucket.
+
+        Args:
+            key (str): the bucket key.
+            policy (Policy): the bucket policy.
+
+        Returns:
+            A tuple with True if the request is allowed, the tokens left and
+            the seconds to wait before retrying.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts, _ = self._buckets.get(key, (policy.burst, now, now))
+            tokens = min(policy.burst, tokens + (now - ts) * policy.rate)
+            allowed = tokens >= policy.cost
+            retry = 0
+            if allowed:
+                tokens -= policy.cost
+            else:
+                retry = (policy.cost - tokens) / policy.rate
+            full_at = now + (policy.burst - tokens) / policy.rate
+            self._buckets[key] = (tokens, now, full_at)
+            # Drop the buckets already full again, they're like new ones
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._buckets = {k: b for k, b in self._buckets.items()
+                                 if b[2] > now}
+            return allowed, tokens, retry
+
+
+class RedisBuckets(object):
+    """Token buckets stored in Redis, falling back to memory on errors."""
+
+    def __init__(self, url=REDIS_URL):
+        """Create the buckets storage.
+
+        Args:
+            url (str): the Redis URL. Default value is REDIS_URL.
+        """
+        self.redis = redis.StrictRedis.from_url(url)
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = MemoryBuckets()
+
+    def take(self, key, policy):
+        """Take the request cost from a bucket.
+
+        Args:
+            key (str): the bucket key.
+            policy (Policy): the bucket policy.
+
+        Returns:
+            A tuple with True if the request is allowed, the tokens left and
+            the seconds to wait before retrying.
+        """
+        try:
+            allowed, tokens, retry = self.script(
+                keys=[key], args=[policy.rate, policy.burst, policy.cost,
+                                  int(time.time() * 1000)])
+        except redis.RedisError:
+            return self.fallback.take(key, policy)
+        return bool(allowed), float(tokens), retry / 1000
+
+
+def create_buckets(url=REDIS_URL):
+    """Create the token buckets storage.
+
+    Args:
+        url (str): the Redis URL. Default value is REDIS_URL.
+
+    Returns:
+        RedisBuckets if the Redis URL is set and the redis package is
+        installed, MemoryBuckets otherwise.
+    """
+    if url and redis is not None:
+        return RedisBuckets(url)
+    return MemoryBuckets()
+
+
+buckets = create_buckets()
+
+
+def rate_limited(view):
+    """Decorator to limit the request rate of a view by its policy.
+
+    The view policy is found by the view name in POLICIES. Requests with
+    methods not limited by the policy are passed through. On protected
+    routes, it must be applied below the JWT decorators, so the buckets are
+    kept per logged user instead of per client IP.
+    """
+    policy = POLICIES[view.__name__]
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if policy.methods and request.method not in policy.methods:
+            return view(*args, **kwargs)
+        user = g.get('user')
+        client = 'user:{}'.format(user.id) if user else request.remote_addr
+        allowed, tokens, retry = buckets.take(
+            'rate_limit:{}:{}'.format(view.__name__, client), policy)
+
+        def add_headers(response):
+            response.headers['X-RateLimit-Limit'] = str(policy.burst)
+            response.headers['X-RateLimit-Remaining'] = str(int(tokens))
+            return response
+
+        if not allowed:
+            response = jsonify(error='Too many requests. Try again later.')
+            response.status_code = 429
+            response.headers['Retry-After'] = str(int(math.ceil(retry)))
+            return add_headers(response)
+
+        after_this_request(add_headers)
+        return view(*args, **kwargs)
+    return wrapper
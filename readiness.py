@@ -0,0 +1,89 @@
+"""Utility module to provide the readiness probe of the app processes.
+
+The process manager or load balancer should send requests to a worker only
+after its /ready route answers 200. The first probe answered by each process
+warms it up: it opens READY_CONNECTIONS connections of every DB pool, so the
+first requests don't pay the connection setup, loads the categories registry
+and compiles all templates. Later probes only check that the DBs answer.
+
+While a DB is unreachable the probe answers 503, and the warm up is retried
+by the next probe.
+"""
+
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+import os
+
+from database import engine, replica_engines, DB_POOL_SIZE
+from category_registry import category_registry
+
+
+logger = logging.getLogger(__name__)
+
+# Connections of each pool opened by the warm up
+READY_CONNECTIONS = int(os.environ.get('DB_READY_CONNECTIONS', DB_POOL_SIZE))
+
+
+def check_pool(bind, connections=1):
+    """Open pool connections at once and check that the DB answers.
+
+    The connections are returned to the pool afterwards, kept idle for the
+    next requests.
+
+    Args:
+        bind: the SQLAlchemy engine.
+        connections (int): the number of connections opened. Default value
+        is 1.
+    """
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(bind.connect())
+            opened[-1].execute(text('SELECT 1'))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+def warm_templates(app):
+    """Compile all templates of the app, so they're in the Jinja cache.
+
+    Args:
+        app: the Flask application.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def init_readiness(app, engines=None):
+    """Register the /ready route in the app.
+
+    Args:
+        app: the Flask application.
+        engines (list): the SQLAlchemy engines checked. Default is the
+        primary engine and the read replicas.
+    """
+    engines = engines or [engine] + replica_engines
+    # The process that warmed up. A forked child warms up again, since its
+    # DB pools start empty.
+    warmed = {'pid': None}
+
+    @app.route('/ready')
+    def ready():
+        """Answer if the process is ready to serve requests."""
+        try:
+            if warmed['pid'] == os.getpid():
+                for e in engines:
+                    check_pool(e)
+            else:
+                for e in engines:
+                    check_pool(e, READY_CONNECTIONS)
+                category_registry.all()
+                warm_templates(app)
+                warmed['pid'] = os.getpid()
+        except SQLAlchemyError as e:
+            logger.warning('Not ready: %s', e)
+            return jsonify(status='unavailable'), 503
+        return jsonify(status='ready')
@@ -0,0 +1,90 @@
+"""Utility module to control catalog revisions and API conditional requests.
+
+Every category has a revision number incremented in the same transaction of
+any item write inside it. The catalog revision is derived from all category
+revisions. The JSON API end points send strong ETags built from these
+revisions and answer matching If-None-Match requests with 304 Not Modified,
+without reading the item table nor serializing anything.
+"""
+
+from functools import wraps
+from hashlib import sha1
+from sqlalchemy import func
+
+from flask import request, make_response
+
+from database import db_session, Category
+
+
+def bump_revisions(*category_ids):
+    """Increment the revision of categories whose items were changed.
+
+    It must be called before the write transaction is committed, so the
+    revision is updated atomically with the items.
+
+    Args:
+        category_ids: the ids of the changed categories.
+    """
+    db_session.query(Category).filter(
+        Category.id.in_(set(category_ids))).update(
+        {Category.revision: Category.revision + 1},
+        synchronize_session=False)
+
+
+def catalog_revision():
+    """Get the revision of the whole catalog.
+
+    Returns:
+        str: a value that changes whenever any category changes.
+    """
+    count, total = db_session.query(
+        func.count(Category.id),
+        func.coalesce(func.sum(Category.revision), 0)).one()
+    return '{}.{}'.format(count, total)
+
+
+def category_revision(category):
+    """Get the revision of a category.
+
+    Args:
+        category (str): the category name.
+
+    Returns:
+        str: the category revision or None if the category doesn't exist.
+    """
+    row = db_session.query(Category.id, Category.revision).filter_by(
+        name=category).first()
+    if row is None:
+        return None
+    return '{}.{}'.format(*row)
+
+
+def conditional(revision):
+    """Decorator to answer API conditional requests with ETags.
+
+    The ETag is built from the revision and the request path with its query
+    arguments, since they change the response content. If the request
+    If-None-Match header matches it, a 304 response is sent without calling
+    the view.
+
+    Args:
+        revision: function receiving the view arguments and returning the
+        revision of the resource, or None to skip the conditional handling.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            rev = revision(*args, **kwargs)
+            if rev is None:
+                return view(*args, **kwargs)
+
+            etag = sha1('{}:{}'.format(
+                rev, request.full_path).encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
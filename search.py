@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+"""Utility module to provide the full text search over the catalog items.
+
+The item name and description are indexed according to the DB:
+    PostgreSQL: a weighted tsvector column with a GIN index;
+    SQLite: a FTS5 virtual table with the item id as rowid.
+
+The index is maintained incrementally by SQLAlchemy mapper events, in the
+same transaction of every item insert, update and delete.
+
+When running this module from command line it will create the search index
+structures and rebuild the index from all items. This is necessary for
+databases created before the search was added.
+"""
+
+from sqlalchemy import event, text
+
+from database import db_session, engine, Item
+from query_loading import route_query, PAGE_SIZE, MAX_PAGE_SIZE
+
+
+# Item name matches are ranked higher than description matches
+PG_VECTOR = ("setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+             "setweight(to_tsvector('english', coalesce(description, '')), "
+             "'B')")
+
+DDL = {
+    'postgresql': [
+        'ALTER TABLE item ADD COLUMN IF NOT EXISTS search_vector tsvector',
+        'CREATE INDEX IF NOT EXISTS ix_item_search_vector ON item '
+        'USING GIN (search_vector)',
+    ],
+    'sqlite': [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS item_fts '
+        'USING fts5(name, description)',
+    ],
+}
+
+SEARCH_SQL = {
+    'postgresql': (
+        "SELECT id FROM item, plainto_tsquery('english', :q) query "
+        "WHERE search_vector @@ query "
+        "ORDER BY ts_rank(search_vector, query) DESC, id "
+        "LIMIT :limit OFFSET :offset"),
+    'sqlite': (
+        'SELECT rowid FROM item_fts WHERE item_fts MATCH :q '
+        'ORDER BY rank, rowid LIMIT :limit OFFSET :offset'),
+}
+
+
+def init_search(bind=engine):
+    """Create the search index structures and index all items.
+
+    Args:
+        bind: the SQLAlchemy engine. Default is the application engine.
+    """
+    dialect = bind.dialect.name
+    with bind.begin() as conn:
+        for statement in DDL.get(dialect, ()):
+            conn.execute(text(statement))
+        if dialect == 'postgresql':
+            conn.execute(text(
+                'UPDATE item SET search_vector = {}'.format(PG_VECTOR)))
+        elif dialect == 'sqlite':
+            conn.execute(text('DELETE FROM item_fts'))
+            conn.execute(text(
+                'INSERT INTO item_fts (rowid, name, description) '
+                'SELECT id, name, description FROM item'))
+
+
+def index_items(connection, after_id):
+    """Index the items inserted bypassing the ORM events.
+
+    Args:
+        connection: the SQLAlchemy connection of the insert transaction.
+        after_id (int): the items with greater id are indexed.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text(
+            'UPDATE item SET search_vector = {} WHERE id > :id'.format(
+                PG_VECTOR)), id=after_id)
+    elif dialect == 'sqlite':
+        connection.execute(text('DELETE FROM item_fts WHERE rowid > :id'),
+                           id=after_id)
+        connection.execute(text(
+            'INSERT INTO item_fts (rowid, name, description) '
+            'SELECT id, name, description FROM item WHERE id > :id'),
+            id=after_id)
+
+
+@event.listens_for(Item, 'after_insert')
+@event.listens_for(Item, 'after_update')
+def index_item(mapper, connection, target):
+    """Add or refresh an item in the search index."""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text(
+            'UPDATE item SET search_vector = {} WHERE id = :id'.format(
+                PG_VECTOR)), id=target.id)
+    elif dialect == 'sqlite':
+        connection.execute(text('DELETE FROM item_fts WHERE rowid = :id'),
+                           id=target.id)
+        connection.execute(text(
+            'INSERT INTO item_fts (rowid, name, description) '
+            'VALUES (:id, :name, :description)'),
+            id=target.id, name=target.name, description=target.description)
+
+
+@event.listens_for(Item, 'after_delete')
+def unindex_item(mapper, connection, target):
+    """Remove an item from the search index."""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM item_fts WHERE rowid = :id'),
+                           id=target.id)
+
+
+def fts5_query(q):
+    """Quote every term of a user query, so FTS5 syntax isn't interpreted.
+
+    Args:
+        q (str): the user query.
+
+    Returns:
+        str: the FTS5 query matching all terms.
+    """
+    return ' '.join('"{}"'.format(t.replace('"', '""')) for t in q.split())
+
+
+def search_items(q, route='search', page=1, limit=PAGE_SIZE):
+    """Search items by name and description, ranked by relevance.
+
+    Args:
+        q (str): the search terms.
+        route (str): the route endpoint name, for its loading options.
+        Default value is 'search'.
+        page (int): the page number, starting from 1. Default value is 1.
+        limit (int): the page size. It's bounded between 1 and MAX_PAGE_SIZE.
+        Default value is PAGE_SIZE.
+
+    Returns:
+        A tuple with the page item list, in rank order, and the next page
+        number or None if this is the last page.
+    """
+    dialect = engine.dialect.name
+    page = max(page or 1, 1)
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    if dialect == 'sqlite':
+        q = fts5_query(q)
+    if not q.strip() or dialect not in SEARCH_SQL:
+        return [], None
+
+    # Fetch one extra id only to know if there is a next page
+    ids = [row[0] for row in db_session.execute(
+        text(SEARCH_SQL[dialect]),
+        {'q': q, 'limit': limit + 1, 'offset': (page - 1) * limit})]
+    next_page = page + 1 if len(ids) > limit else None
+    ids = ids[:limit]
+    if not ids:
+        return [], None
+
+    items = route_query(route).filter(Item.id.in_(ids)).all()
+    rank = {id: n for n, id in enumerate(ids)}
+    items.sort(key=lambda i: rank[i.id])
+    return items, next_page
+
+
+# When running this module from command line it will create the search index
+# and index all items.
+if __name__ == '__main__':
+    init_search()
+    print('Search index rebuilt.')
@@ -0,0 +1,98 @@
+"""Tests of the SQL statements budget of the read only routes.
+
+They run the app against a temporary SQLite DB, from the project folder:
+
+    python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+# The DB settings are read when the database module is imported
+_folder = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_folder, 'test.db')
+os.environ['CATEGORY_NOTIFY_FILE'] = os.path.join(_folder, 'categories')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from application import create_app  # noqa: E402
+from database import db_session, init_db, User, Category, Item  # noqa: E402
+from page_cache import page_cache  # noqa: E402
+from query_loading import assert_query_budget  # noqa: E402
+
+# Enough items per category to expose one query per rendered item
+ITEMS_PER_CATEGORY = 20
+
+
+class QueryBudgetTest(unittest.TestCase):
+    """Every route must issue at most the statements of its budget."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the DB with two users, two categories and their items."""
+        init_db()
+        users = [User(username='user{}'.format(n),
+                      email='user{}@example.com'.format(n))
+                 for n in range(2)]
+        categories = [Category(name='Soccer'), Category(name='Hockey')]
+        db_session.add_all(users + categories)
+        db_session.flush()
+        for category in categories:
+            for n in range(ITEMS_PER_CATEGORY):
+                db_session.add(Item(name='item{}'.format(n),
+                                    description='Item {}.'.format(n),
+                                    category_id=category.id,
+                                    user_id=users[n % 2].id))
+        db_session.commit()
+        cls.user_id = users[0].id
+        db_session.remove()
+        cls.app = create_app({'TESTING': True})
+
+    def setUp(self):
+        """Start every test with an empty page cache."""
+        page_cache.clear()
+        self.client = self.app.test_client()
+
+    def login(self):
+        """Send the access token of a user in the next requests."""
+        with self.app.test_request_context():
+            token = create_access_token(identity=self.user_id)
+        self.client.set_cookie('localhost', 'access_token_cookie', token)
+
+    def assertWithinBudget(self, route, path):
+        """Request a path and check its status and statements count."""
+        with assert_query_budget(route):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+
+    def test_pages(self):
+        for route, path in (('catalog', '/catalog'),
+                            ('category', '/catalog/Soccer'),
+                            ('item', '/catalog/Soccer/item1'),
+                            ('search', '/catalog/search?q=item')):
+            self.assertWithinBudget(route, path)
+
+    def test_pages_logged_in(self):
+        self.login()
+        for route, path in (('catalog', '/catalog'),
+                            ('category', '/catalog/Hockey'),
+                            ('item', '/catalog/Hockey/item2'),
+                            ('edit_item', '/catalog/Hockey/item2/edit'),
+                            ('delete_item', '/catalog/Hockey/item2/delete')):
+            self.assertWithinBudget(route, path)
+
+    def test_api(self):
+        self.login()
+        for route, path in (
+                ('catalog_json', '/catalog/api/v1/catalog.json'),
+                ('category_json', '/catalog/api/v1/Soccer.json'),
+                ('item_json', '/catalog/api/v1/Soccer/item3.json'),
+                ('search_json', '/catalog/api/v1/search.json?q=item')):
+            self.assertWithinBudget(route, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+"""Utility module to control the revoked JWT tokens.
+
+The revoked tokens JTIs are stored in Redis with a TTL equal to the token
+expiration. To avoid a network round trip on every request, each process
+keeps a bloom filter of the revoked JTIs. Tokens not in the filter, the
+common case, are known not revoked without asking Redis. Only filter hits are
+confirmed in Redis, since bloom filters may have false positives.
+
+The filter receives the revocations from other processes by polling a Redis
+sorted set of the revocations, ordered by revocation time, for the ones made
+since the last poll. A token revoked in another process is then rejected
+after at most SYNC_INTERVAL seconds.
+
+While Redis is unreachable, filter hits are taken as revoked, so a revoked
+token is never accepted, and the filter keeps the revocations it has until a
+poll succeeds again. Revocations that couldn't be stored are kept in the
+process and stored by the next successful poll.
+
+Without REDIS_URL or the redis package an in-memory backend is used. It's
+only suitable for tests and single process deployments.
+"""
+
+from hashlib import blake2b
+from threading import Lock
+import logging
+import math
+import os
+import time
+
+# Optional dependency. The in-memory backend is used without it.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.environ.get('REDIS_URL')
+# Seconds between polls of other processes revocations
+SYNC_INTERVAL = 1.0
+# Seconds between full rebuilds of the filter, dropping expired tokens
+REBUILD_INTERVAL = 3600
+# Seconds of revocations fetched again on each poll, to cover clock skew
+# between the processes hosts
+CLOCK_SKEW = 5
+# Maximum token lifetime, the refresh token default expiration. Older
+# revocations are dropped from the revocations log.
+MAX_TOKEN_LIFETIME = 30 * 24 * 3600
+# Expected number of revoked, not yet expired, tokens and the filter false
+# positive rate at that size
+FILTER_CAPACITY = int(os.environ.get('BLOCKLIST_FILTER_CAPACITY', 100000))
+FILTER_ERROR_RATE = 0.01
+# Errors of the Redis backend. The in-memory backend doesn't fail.
+BACKEND_ERRORS = (redis.RedisError,) if redis is not None else ()
+
+
+class BloomFilter(object):
+    """Probabilistic set of strings without false negatives."""
+
+    def __init__(self, capacity=FILTER_CAPACITY,
+                 error_rate=FILTER_ERROR_RATE):
+        """Create an empty filter sized for the capacity and error rate.
+
+        Args:
+            capacity (int): expected number of elements.
+            error_rate (float): false positive rate at full capacity.
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        """Get the bit positions of a value, by double hashing."""
+        digest = blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        """Add a value to the filter."""
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, value):
+        """Check if a value may be in the filter."""
+        return all(self.bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(value))
+
+
+class RedisBackend(object):
+    """Revoked tokens storage in Redis."""
+
+    KEY = 'revoked_token:{}'
+    LOG = 'revoked_tokens'
+
+    def __init__(self, url=REDIS_URL):
+        """Create the backend. The connection is opened when first used.
+
+        Args:
+            url (str): the Redis URL. Default value is REDIS_URL.
+        """
+        self.redis = redis.StrictRedis.from_url(url)
+
+    def add(self, jti, expires_at):
+        """Store a revoked token until it expires.
+
+        Args:
+            jti (str): the token unique identifier.
+            expires_at (float): the token expiration timestamp.
+        """
+        now = time.time()
+        ttl = max(1, int(math.ceil(expires_at - now)))
+        with self.redis.pipeline() as pipe:
+            pipe.setex(self.KEY.format(jti), ttl, 1)
+            pipe.zadd(self.LOG, {jti: now})
+            pipe.zremrangebyscore(self.LOG, '-inf', now - MAX_TOKEN_LIFETIME)
+            pipe.execute()
+
+    def contains(self, jti):
+        """Check if a token is revoked.
+
+        Args:
+            jti (str): the token unique identifier.
+
+        Returns:
+            bool: True if the token is revoked.
+        """
+        return bool(self.redis.exists(self.KEY.format(jti)))
+
+    def revoked(self, since=0):
+        """Get the tokens revoked since a moment.
+
+        Args:
+            since (float): the timestamp to get the revocations from.
+            Default value is 0, all logged revocations.
+
+        Returns:
+            list: the tokens JTIs.
+        """
+        return [jti.decode('utf-8') for jti in self.redis.zrangebyscore(
+            self.LOG, since, '+inf')]
+
+
+class MemoryBackend(object):
+    """Revoked tokens storage in the process memory."""
+
+    def __init__(self):
+        """Create an empty storage."""
+        self._tokens = {}
+        self._lock = Lock()
+
+    def add(self, jti, expires_at):
+        """Store a revoked token until it expires.
+
+        Args:
+            jti (str): the token unique identifier.
+            expires_at (float): the token expiration timestamp.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = {k: v for k, v in self._tokens.items()
+                            if v[1] > now}
+            self._tokens[jti] = (now, expires_at)
+
+    def contains(self, jti):
+        """Check if a token is revoked.
+
+        Args:
+            jti (str): the token unique identifier.
+
+        Returns:
+            bool: True if the token is revoked.
+        """
+        return self._tokens.get(jti, (0, 0))[1] > time.time()
+
+    def revoked(self, since=0):
+        """Get the tokens revoked since a moment.
+
+        Args:
+            since (float): the timestamp to get the revocations from.
+            Default value is 0, all stored revocations.
+
+        Returns:
+            list: the tokens JTIs.
+        """
+        return [k for k, v in list(self._tokens.items()) if v[0] >= since]
+
+
+class TokenBlocklist(object):
+    """Revoked tokens blocklist with a local bloom filter fast path."""
+
+    def __init__(self, backend, sync_interval=SYNC_INTERVAL,
+                 rebuild_interval=REBUILD_INTERVAL):
+        """Create the blocklist.
+
+        Args:
+            backend: the revoked tokens storage, RedisBackend or
+            MemoryBackend.
+            sync_interval (float): seconds between polls of the revocations
+            from other processes. Default value is SYNC_INTERVAL.
+            rebuild_interval (float): seconds between rebuilds of the filter.
+            Default value is REBUILD_INTERVAL.
+        """
+        self.backend = backend
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self._filter = BloomFilter()
+        self._synced = 0
+        self._synced_at = 0
+        self._rebuilt = 0
+        # Revocations not stored yet, expiration timestamps by JTI
+        self._pending = {}
+        self._lock = Lock()
+
+    def revoke(self, jti, expires_at):
+        """Revoke a token.
+
+        If the backend fails, the token is still rejected by this process
+        and the revocation is stored by the next successful sync.
+
+        Args:
+            jti (str): the token unique identifier.
+            expires_at (float): the token expiration timestamp.
+
+        Returns:
+            bool: True if the revocation was stored, False if it's pending.
+        """
+        with self._lock:
+            self._filter.add(jti)
+        try:
+            self.backend.add(jti, expires_at)
+        except BACKEND_ERRORS as e:
+            logger.warning('Token revocation failed, kept pending: %s', e)
+            with self._lock:
+                self._pending[jti] = expires_at
+            return False
+        return True
+
+    def is_revoked(self, jti):
+        """Check if a token is revoked.
+
+        Args:
+            jti (str): the token unique identifier.
+
+        Returns:
+            bool: True if the token is revoked, or if it may be and the
+            backend can't confirm it.
+        """
+        self._sync()
+        if jti not in self._filter:
+            return False
+        if jti in self._pending:
+            return True
+        try:
+            return self.backend.contains(jti)
+        except BACKEND_ERRORS as e:
+            logger.warning('Revoked token check failed: %s', e)
+            return True
+
+    def _sync(self):
+        """Add the other processes revocations to the filter if it's time."""
+        now = time.monotonic()
+        if now < self._synced + self.sync_interval:
+            return
+        with self._lock:
+            if now < self._synced + self.sync_interval:
+                return
+            bloom = self._filter
+            since = self._synced_at - CLOCK_SKEW
+            rebuild = now > self._rebuilt + self.rebuild_interval
+            if rebuild:
+                # Start over, so expired tokens leave the filter. The new
+                # filter replaces the old one only when complete.
+                bloom = BloomFilter()
+                since = 0
+            synced_at = time.time()
+            try:
+                for pending_jti, expires_at in list(self._pending.items()):
+                    self.backend.add(pending_jti, expires_at)
+                    del self._pending[pending_jti]
+                revoked = self.backend.revoked(since)
+            except BACKEND_ERRORS as e:
+                # Keep the current filter. The next poll, after the sync
+                # interval, fetches the revocations missed by this one.
+                logger.warning('Revoked tokens sync failed: %s', e)
+                self._synced = now
+                return
+            for jti in revoked:
+                bloom.add(jti)
+            self._filter = bloom
+            self._synced = now
+            self._synced_at = synced_at
+            if rebuild:
+                self._rebuilt = now
+
+
+def create_backend(url=REDIS_URL):
+    """Create the revoked tokens storage.
+
+    Args:
+        url (str): the Redis URL. Default value is REDIS_URL.
+
+    Returns:
+        A RedisBackend if the Redis URL is set and the redis package is
+        installed, a MemoryBackend otherwise.
+    """
+    if url and redis is not None:
+        return RedisBackend(url)
+    return MemoryBackend()
+
+
+token_blocklist = TokenBlocklist(create_backend())